@@ -1,14 +1,35 @@
+import asyncio
+import contextlib
 import io
 import random
 import time
 from datetime import datetime
 
+import aiohttp
 import discord
-from discord.ext import commands
-from easy_pil import Canvas, Editor, Font, load_image_async
-from tabulate import tabulate
+from discord.ext import commands, tasks
+from motor.motor_asyncio import AsyncIOMotorCollection
+from PIL import Image
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 
+from helpers.accumulator import Accumulator
 from helpers.bot import Bonbons
+from helpers.levels.avatars import AvatarCache
+from helpers.levels.cache import ImageCache, fingerprint
+from helpers.levels.cooldown import XPCooldown
+from helpers.levels.curve import LevelCurve
+from helpers.levels.export import FORMATS, export_levels
+from helpers.levels.migrate import recompute_levels
+from helpers.levels.ranks import GuildRanks, RankIndex
+from helpers.levels.render import (
+    RenderError,
+    RenderPool,
+    pack,
+    render_leaderboard,
+    render_rank_card,
+)
+from helpers.storage import GuildCollection
 
 
 class Levels(commands.Cog):
@@ -19,134 +40,270 @@ class Levels(commands.Cog):
 
     def __init__(self, bot: Bonbons) -> None:
         self.bot = bot
-        self.db = self.bot.mongo["levels"]
-        self.levels: dict[int, int] = {}
-        self.make_levels()
+        self.levels = LevelCurve(step=125)
+        self.accumulator = Accumulator(self.write_xp, max_pending=500, name="XP")
+        self.renderer = RenderPool(workers=2, max_pending=8, timeout=10)
+        self.avatars = AvatarCache(
+            ".cache/avatars", max_bytes=32 * 1024 * 1024, max_disk_bytes=256 * 1024 * 1024
+        )
+        self.leaderboards = ImageCache(max_bytes=16 * 1024 * 1024)
+        self.ranks = RankIndex(self.load_ranks, max_entries=500_000)
+        self.cooldowns = XPCooldown(window=60, max_window=3600)
+        self.settings = self.bot.mongo["levels"]["settings"]
         self.set_attributes()
+        self.flush_xp.start()
 
     @property
     def emoji(self) -> str:
         return "⬆️"
 
-    def make_levels(self) -> None:
-        for number in range(500):
-            self.levels[number] = 125 * number
+    def collection(self, guild_id: int) -> AsyncIOMotorCollection | GuildCollection:
+        return self.bot.storage.collection("levels", guild_id)
 
     def set_attributes(self) -> None:
         self.bot.generate_rank_card = self.generate_rank_card
         self.bot.generate_leaderboard = self.generate_leaderboard
+        self.bot.storage.holds["levels"] = self.hold_xp
+
+    async def cog_load(self) -> None:
+        await asyncio.to_thread(self.avatars.scan)
+
+        async for settings in self.settings.find({"cooldown": {"$exists": True}}):
+            self.cooldowns.set_window(settings["_id"], settings["cooldown"])
+
+    async def cog_unload(self) -> None:
+        self.bot.storage.holds.pop("levels", None)
+        self.flush_xp.stop()
+        self.renderer.close()
+        await self.accumulator.close()
+
+    @contextlib.asynccontextmanager
+    async def hold_xp(self, guild_id: int):
+        """Writes a guild's pending XP and holds back any more until exiting."""
+
+        await self.accumulator.flush(guild_id)
+
+        async with self.accumulator.lock(guild_id):
+            yield
+
+    @tasks.loop(seconds=10)
+    async def flush_xp(self) -> None:
+        await self.accumulator.flush_all()
+
+    def xp_pipeline(self, xp: int) -> list[dict]:
+        """
+        Builds an update pipeline that adds `xp` to a user's total and sets
+        their level from the curve on the server, so a single upsert is
+        enough per user. Documents from before the cumulative model are
+        converted on the way.
+        """
+
+        total = {
+            "$cond": [
+                {"$eq": ["$v", 2]},
+                "$xp",
+                {
+                    "$add": [
+                        self.levels.mql_total({"$ifNull": ["$level", 1]}),
+                        {"$ifNull": ["$xp", 0]},
+                    ]
+                },
+            ]
+        }
+
+        return [
+            {"$set": {"xp": {"$toLong": {"$add": [total, xp]}}, "v": 2}},
+            {"$set": {"level": self.levels.mql_level("$xp")}},
+        ]
+
+    async def write_xp(self, guild_id: int, pending: dict[int, int]) -> None:
+        db = self.collection(guild_id)
+
+        operations = [
+            UpdateOne({"_id": user_id}, self.xp_pipeline(xp), upsert=True)
+            for user_id, xp in pending.items()
+        ]
+
+        try:
+            await db.bulk_write(operations, ordered=False)
+        except BulkWriteError as err:
+            # The accumulator retries the failed users, the others are written.
+            failed = {error["index"] for error in err.details.get("writeErrors", ())}
+            self.mirror_ranks(
+                guild_id,
+                {
+                    user_id: xp
+                    for index, (user_id, xp) in enumerate(pending.items())
+                    if index not in failed
+                },
+            )
+            raise
+
+        self.mirror_ranks(guild_id, pending)
+
+    def mirror_ranks(self, guild_id: int, written: dict[int, int]) -> None:
+        """Adds written XP to the rank index if the guild is loaded."""
+
+        ranks = self.ranks.peek(guild_id)
+
+        if ranks is not None:
+            for user_id, xp in written.items():
+                self.ranks.update(guild_id, user_id, (ranks.get(user_id) or 0) + xp)
+
+    def export_row(self, document: dict) -> dict:
+        xp = self.levels.total_xp(document)
+        return {"_id": document["_id"], "level": self.levels.level(xp), "xp": xp}
+
+    async def load_ranks(self, guild_id: int):
+        cursor = self.collection(guild_id).find({}, {"level": 1, "xp": 1, "v": 1})
+
+        with self.bot.budgets.track("Levels.load_ranks"):
+            async for document in cursor:
+                yield document["_id"], self.levels.total_xp(document)
+
+    async def read_image(self, url: str) -> bytes:
+        async with self.bot.session.get(url) as resp:
+            return await resp.read()
 
     async def generate_rank_card(
         self, ctx: commands.Context, member: discord.Member, data, background=None
     ) -> None:
-        next_level_xp = self.levels[int(data["level"]) + 1]
-        percentage = (data["xp"] / next_level_xp) * 100
+        level, xp, next_level_xp = self.levels.progress(self.levels.total_xp(data))
+        ranks = await self.get_ranks(ctx.guild.id)
         user_data = {
             "name": str(member),
-            "xp": int(data["xp"]),
+            "xp": xp,
             "next_level_xp": next_level_xp,
-            "level": int(data["level"]),
-            "percentage": int(percentage),
+            "level": level,
+            "percentage": int(xp / next_level_xp * 100),
+            "rank": ranks.position(member.id),
+            "members": len(ranks),
+            "avatar": pack(await self.avatars.get(member, 150)),
+            "background": await self.read_image(str(background))
+            if background
+            else None,
         }
 
-        if background:
-            background = Editor(await load_image_async(str(background))).resize(
-                (800, 280)
+        try:
+            image = await self.renderer.render(render_rank_card, user_data)
+        except RenderError:
+            rank = user_data["rank"]
+            return await ctx.send(
+                f"**{user_data['name']}** • Level {user_data['level']}"
+                + f" • XP {user_data['xp']:,} / {user_data['next_level_xp']:,}"
+                + (f" • Rank #{rank:,} of {len(ranks):,}" if rank else "")
             )
-        else:
-            background = Editor(Canvas((800, 280), color="#23272A"))
-
-        profile_image = await load_image_async(str(member.display_avatar.url))
-        profile = Editor(profile_image).resize((150, 150)).circle_image()
-
-        poppins = Font.poppins(size=40)
-        poppins_small = Font.poppins(size=30)
-
-        card_right_shape = [(600, 0), (750, 300), (900, 300), (900, 0)]
 
-        background.polygon(card_right_shape, "#2C2F33")
-        background.paste(profile, (30, 30))
-
-        background.rectangle((30, 200), width=650, height=40, fill="#494b4f", radius=20)
-        background.bar(
-            (30, 200),
-            max_width=650,
-            height=40,
-            percentage=user_data["percentage"],
-            fill="#3db374",
-            radius=20,
-        )
-        background.text((200, 40), user_data["name"], font=poppins, color="white")
-
-        background.rectangle((200, 100), width=350, height=2, fill="#17F3F6")
-        background.text(
-            (200, 130),
-            f"Level: {user_data['level']} "
-            + f" XP: {user_data['xp']: ,} / {user_data['next_level_xp']: ,}",
-            font=poppins_small,
-            color="white",
+        embed = discord.Embed(color=discord.Color.blurple())
+        embed.set_image(url="attachment://rank_card.png")
+        return await ctx.send(
+            file=discord.File(io.BytesIO(image), "rank_card.png"), embed=embed
         )
 
-        with io.BytesIO() as buffer:
-            background.save(buffer, "PNG")
-            buffer.seek(0)
-
-            embed = discord.Embed(color=discord.Color.blurple())
-            embed.set_image(url="attachment://rank_card.png")
-            return await ctx.send(
-                file=discord.File(buffer, "rank_card.png"), embed=embed
-            )
+    async def get_ranks(self, guild_id: int) -> GuildRanks:
+        if self.ranks.peek(guild_id) is not None:
+            return await self.ranks.get(guild_id)
+
+        # Loading under the flush lock keeps a flush from landing halfway
+        # through the scan and being counted twice or not at all.
+        async with self.accumulator.lock(guild_id):
+            return await self.ranks.get(guild_id)
+
+    async def get_or_fetch_user(self, user_id: int) -> discord.User:
+        return self.bot.get_user(user_id) or await self.bot.fetch_user(user_id)
+
+    @staticmethod
+    async def bounded(coro, semaphore: asyncio.Semaphore, timeout: float = 3):
+        """Awaits `coro` under `semaphore`, returning None if it fails or is slow."""
+
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(coro, timeout)
+            except (
+                asyncio.TimeoutError,
+                aiohttp.ClientError,
+                discord.DiscordException,
+                OSError,
+            ):
+                return None
+
+    async def get_avatar(
+        self, user: discord.User | None, size: int, semaphore: asyncio.Semaphore
+    ) -> Image.Image:
+        avatar = user and await self.bounded(self.avatars.get(user, size), semaphore)
+        return avatar or self.avatars.placeholder(size)
 
     async def generate_leaderboard(self, ctx: commands.Context) -> None:
 
         before = time.perf_counter()
-        background = Editor(Canvas((1400, 1280), color="#23272A"))
-        db = self.db[str(ctx.guild.id)]
-        paste_size = 0
-        text_size = 40
+        ranks = await self.get_ranks(ctx.guild.id)
+        semaphore = asyncio.Semaphore(5)
+
+        documents = [
+            {"_id": user_id, "level": self.levels.level(xp)}
+            for user_id, xp in ranks.top(10)
+        ]
+        users = await asyncio.gather(
+            *(
+                self.bounded(self.get_or_fetch_user(x["_id"]), semaphore)
+                for x in documents
+            )
+        )
+        rows = [
+            {
+                "name": str(user) if user else f"Unknown user ({x['_id']})",
+                "level": x["level"],
+            }
+            for x, user in zip(documents, users)
+        ]
+
+        key = fingerprint(
+            [
+                (x["_id"], x["level"], user and user.display_avatar.key, row["name"])
+                for x, user, row in zip(documents, users, rows)
+            ]
+        )
+        image = self.leaderboards.get(ctx.guild.id, key)
+        cached = image is not None
 
-        for x in await db.find().sort("level", -1).to_list(10):
+        if not cached:
+            avatars = await asyncio.gather(
+                *(self.get_avatar(user, 128, semaphore) for user in users)
+            )
 
-            user = self.bot.get_user(x["_id"]) or await self.bot.fetch_user(x["_id"])
+            for row, avatar in zip(rows, avatars):
+                row["avatar"] = pack(avatar)
 
-            if user.avatar is None:
-                img = Editor(await load_image_async(str(user.display_avatar))).resize(
-                    (128, 128)
+            try:
+                image = await self.renderer.render(render_leaderboard, rows)
+            except RenderError:
+                lines = (
+                    f'{index}. {row["name"]} • Level{row["level"]: ,}'
+                    for index, row in enumerate(rows, start=1)
                 )
-            else:
-                img = await load_image_async(
-                    str(user.display_avatar.with_size(128).with_format("png"))
+                return await ctx.send(
+                    f"**{ctx.guild.name} Level Leaderboard**\n" + "\n".join(lines)
                 )
 
-            background.text(
-                (175, text_size),
-                f'{str(user)} • Level{x["level"]: ,}',
-                color="white",
-                font=Font.poppins(size=50),
-            )
-
-            background.paste(img, (0, paste_size))
-            paste_size += 128
-            text_size += 130
-
-        with io.BytesIO() as buffer:
-            background.save(buffer, "PNG")
-            buffer.seek(0)
+            # Don't keep serving placeholders once the real avatars are reachable.
+            placeholder = self.avatars.placeholder(128)
+            if all(avatar is not placeholder for avatar in avatars):
+                self.leaderboards.set(ctx.guild.id, key, image)
 
-            done = time.perf_counter() - before
+        done = time.perf_counter() - before
 
-            embed = discord.Embed(
-                title=f"{ctx.guild.name} Level Leaderboard",
-                description="This is based off of your level and not XP.",
-                color=discord.Color.blurple(),
-                timestamp=datetime.utcnow(),
-            )
-            embed.set_image(url="attachment://leaderboard.png")
-            embed.set_footer(text=f"Took{done: .2f}s")
+        embed = discord.Embed(
+            title=f"{ctx.guild.name} Level Leaderboard",
+            description="This is based off of your level and not XP.",
+            color=discord.Color.blurple(),
+            timestamp=datetime.utcnow(),
+        )
+        embed.set_image(url="attachment://leaderboard.png")
+        embed.set_footer(text=f"Took{done: .2f}s" + (" (cached)" if cached else ""))
 
-            return await ctx.send(
-                file=discord.File(buffer, "leaderboard.png"), embed=embed
-            )
+        return await ctx.send(
+            file=discord.File(io.BytesIO(image), "leaderboard.png"), embed=embed
+        )
 
     @commands.command(name="rank", aliases=("level",))
     @commands.cooldown(1, 20, commands.BucketType.user)
@@ -155,58 +312,142 @@ class Levels(commands.Cog):
 
         member = member or ctx.author
 
-        db = self.db[str(ctx.guild.id)]
+        await self.accumulator.flush(ctx.guild.id)
+        ranks = await self.get_ranks(ctx.guild.id)
 
-        data = await db.find_one({"_id": member.id})
+        xp = ranks.get(member.id)
 
-        if data is not None:
-            return await self.generate_rank_card(ctx, member, data)
+        if xp is not None:
+            return await self.generate_rank_card(
+                ctx, member, {"_id": member.id, "xp": xp, "v": 2}
+            )
 
         await ctx.reply(
             "You have no XP somehow. Send some more messages into the chat and try again.."
         )
 
     @commands.command(name="setlevel")
+    @commands.has_permissions(manage_guild=True)
     @commands.cooldown(1, 20, commands.BucketType.user)
     async def setlevel(self, ctx: commands.Context, member: discord.Member, level: int):
 
-        db = self.db[str(ctx.guild.id)]
+        if not 1 <= level <= self.levels.max_level:
+            return await ctx.reply(f"Levels go from 1 to {self.levels.max_level:,}.")
+
+        xp = self.levels.total(level)
 
-        data = await db.find_one({"_id": member.id})
+        # Pending XP is added on top of the new level rather than before it.
+        async with self.hold_xp(ctx.guild.id):
+            result = await self.collection(ctx.guild.id).update_one(
+                {"_id": member.id}, {"$set": {"xp": xp, "level": level, "v": 2}}
+            )
 
-        if data is not None:
-            await self.db.update_one({"_id": data["_id"]}, {"$set": {"level": level}})
+        if result.matched_count:
+            self.ranks.update(ctx.guild.id, member.id, xp)
             return await ctx.reply(f"{member}'s level has been set to {level}.")
 
+    @commands.command(name="xpcooldown")
+    @commands.has_permissions(manage_guild=True)
+    async def xpcooldown(self, ctx: commands.Context, seconds: int = None):
+        """Shows or sets how many seconds members wait between earning XP."""
+
+        if seconds is None:
+            window = self.cooldowns.get_window(ctx.guild.id)
+            return await ctx.reply(f"Members earn XP at most once every {window:g} seconds.")
+
+        if not 0 <= seconds <= self.cooldowns.max_window:
+            return await ctx.reply(
+                f"The cooldown must be between 0 and {self.cooldowns.max_window:g} seconds."
+            )
+
+        await self.settings.update_one(
+            {"_id": ctx.guild.id}, {"$set": {"cooldown": seconds}}, upsert=True
+        )
+        self.cooldowns.set_window(ctx.guild.id, seconds)
+        await ctx.reply(f"Members now earn XP at most once every {seconds} seconds.")
+
+    @commands.command(name="recomputelevels", hidden=True)
+    @commands.is_owner()
+    async def recomputelevels(self, ctx: commands.Context, scope: str = None):
+        """Recomputes the level and total XP of every member, `all` for every server."""
+
+        guilds = self.bot.guilds if scope == "all" else [ctx.guild]
+        modified = 0
+
+        async with ctx.typing():
+            for guild in guilds:
+                async with self.hold_xp(guild.id):
+                    modified += await recompute_levels(self.collection(guild.id), self.levels)
+
+                self.ranks.invalidate(guild.id)
+
+        await ctx.reply(f"Updated {modified:,} members in {len(guilds):,} server(s).")
+
     @commands.command(name="leaderboard", aliases=("lb",))
     @commands.cooldown(1, 20, commands.BucketType.user)
     async def leaderboard(self, ctx: commands.Context, args: str = None):
-        """Shows the level leaderboard for the current server."""
+        """
+        Shows the level leaderboard for the current server.
+
+        Pass `--text` (or `--all`), `--csv` or `--jsonl` to get every member as a file.
+        """
+
+        await self.accumulator.flush(ctx.guild.id)
 
         if args:
-            if args == "--text" or args == "--all":
-                data = {"level": [], "xp": [], "id": []}
-                db = self.db[str(ctx.guild.id)]
-
-                async for doc in db.find().sort("level", -1):
-                    data["level"].append(doc["level"])
-                    data["xp"].append(doc["xp"])
-                    data["id"].append(doc["_id"])
-
-                content = tabulate(
-                    {"ID": data["id"], "Level": data["level"], "XP": data["xp"]},
-                    ["ID", "Level", "XP"],
-                    tablefmt="pretty",
-                )
-                file = discord.File(
-                    io.BytesIO(content.encode("utf-8")), filename="text.txt"
-                )
-                return await ctx.send(file=file)
-            else:
-                pass
+            format = {
+                "--text": "text",
+                "--all": "text",
+                "--csv": "csv",
+                "--jsonl": "jsonl",
+            }.get(args)
+
+            if format is not None:
+                db = self.collection(ctx.guild.id)
+                # `xp` is the total for current documents but the XP into the
+                # level for older ones, so each kind is sorted on its own and
+                # the two are merged by total.
+                cursors = [
+                    db.find(query, {"level": 1, "xp": 1, "v": 1}).sort(
+                        [("level", -1), ("xp", -1)]
+                    )
+                    for query in ({"v": 2}, {"v": {"$ne": 2}})
+                ]
+
+                async with ctx.typing():
+                    with self.bot.budgets.track("leaderboard export"):
+                        file = await export_levels(
+                            cursors,
+                            format,
+                            transform=self.export_row,
+                            key=lambda document: (
+                                -document.get("level", 1),
+                                -self.levels.total_xp(document),
+                            ),
+                        )
+
+                    with file:
+                        extension = FORMATS[format][0]
+                        return await ctx.send(
+                            file=discord.File(file, filename=f"levels.{extension}")
+                        )
 
         await self.generate_leaderboard(ctx)
 
+    @commands.Cog.listener("on_user_update")
+    async def invalidate_avatar(self, before: discord.User, after: discord.User) -> None:
+        # Only a replaced avatar, members with a guild avatar still show theirs.
+        if before.avatar is not None and before.avatar.key != getattr(after.avatar, "key", None):
+            await self.avatars.invalidate(before.avatar.key)
+
+    @commands.Cog.listener("on_member_update")
+    async def invalidate_guild_avatar(self, before: discord.Member, after: discord.Member) -> None:
+        # The global avatar is still used elsewhere, only the guild one is gone.
+        if before.guild_avatar is not None and before.guild_avatar.key != getattr(
+            after.guild_avatar, "key", None
+        ):
+            await self.avatars.invalidate(before.guild_avatar.key)
+
     @commands.Cog.listener("on_message")
     async def handle_message(self, message: discord.Message):
 
@@ -216,29 +457,13 @@ class Levels(commands.Cog):
         if not isinstance(message.channel, discord.TextChannel):
             return
 
-        db = self.db[str(message.guild.id)]
-
-        data = await db.find_one({"_id": message.author.id})
-        xp = random.randint(10, 200)
-
-        if data is not None:
-
-            next_level = data["level"] + 1
-            next_level_xp = self.levels[next_level]
-
-            if int(data["xp"]) >= int(next_level_xp):
-                await db.update_one({"_id": message.author.id}, {"$inc": {"level": 1}})
-                await db.update_one(
-                    {"_id": message.author.id}, {"$set": {"xp": xp / 2}}
-                )
+        with self.bot.budgets.track("Levels.handle_message"):
+            if not self.cooldowns.allow(message.guild.id, message.author.id):
                 return
 
-            await db.update_one({"_id": message.author.id}, {"$inc": {"xp": xp}})
-            return
-
-        if data is None:
-            await db.insert_one({"_id": message.author.id, "xp": xp, "level": 1})
-            return
+            self.accumulator.add(
+                message.guild.id, message.author.id, random.randint(10, 200)
+            )
 
 
 async def setup(bot):
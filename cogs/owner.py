@@ -6,7 +6,7 @@ import traceback
 import discord
 from discord.ext import commands
 
-from helpers.bot import Bonbons
+from helpers.bot import DATABASES, Bonbons
 from helpers.paginator import Paginator
 
 
@@ -89,6 +89,25 @@ class Owner(commands.Cog, command_attrs=dict(hidden=True)):
         )
         await ctx.reply(embed=embed)
 
+    @commands.command(name="migratestorage")
+    async def migrate_storage(self, ctx: commands.Context, feature: str = None) -> None:
+
+        """Moves per-server collections into the shared ones, can be resumed."""
+
+        features = DATABASES if feature is None else (feature.lower(),)
+
+        if any(feature not in DATABASES for feature in features):
+            return await ctx.reply(f"Choose one of: {', '.join(DATABASES)}")
+
+        lines = []
+
+        async with ctx.typing():
+            for feature in features:
+                guilds, documents = await self.bot.storage.migrate_all(feature)
+                lines.append(f"{feature}: {guilds:,} server(s), {documents:,} documents")
+
+        await ctx.reply("\n".join(lines))
+
     @commands.Cog.listener("on_message_edit")
     async def _re_invoke_owner_commands(
         self, before: discord.Message, after: discord.Message
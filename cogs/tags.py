@@ -1,12 +1,27 @@
+import asyncio
+import contextlib
 import copy
+import re
 from datetime import datetime
-from typing import Union
+from typing import Optional, Union
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
 
+from helpers.accumulator import Accumulator
 from helpers.bot import Bonbons
+from helpers.indexes import NAME_COLLATION
+from helpers.paginator import KeysetPaginator
+from helpers.storage import GuildCollection
+from helpers.tags.cache import TagCache
 from helpers.tags.engine import TagEngine
+from helpers.tags.ids import IDAllocator
+from helpers.tags.names import TagNames
+from helpers.tags.top import TopTags
+from helpers.tags.transfer import POLICIES, export_tags, import_tags, read_rows
 
 class Tags(commands.Cog):
 
@@ -14,7 +29,91 @@ class Tags(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.db = self.bot.mongo["tags"]
+        self.names = TagNames(self.load_names, max_names=200_000)
+        self.ids = IDAllocator(self.bot.mongo["tags"]["counters"])
+        self.cache = TagCache(max_entries=2048, ttl=300)
+        # Counts uses the same way levels counts XP, per tag instead of per member.
+        self.uses = Accumulator(self.write_uses, max_pending=500, name="tag uses")
+        self.popular = TopTags(size=10, max_guilds=1000)
+        self._locks: dict[int, asyncio.Lock] = {}
+        self.bot.storage.holds["tags"] = self.hold_tags
+        self.flush_uses.start()
+
+    def collection(self, guild_id: int) -> AsyncIOMotorCollection | GuildCollection:
+        return self.bot.storage.collection("tags", guild_id)
+
+    def lock(self, guild_id: int) -> asyncio.Lock:
+        """The lock held around every write to a guild's tags."""
+        return self._locks.setdefault(guild_id, asyncio.Lock())
+
+    @contextlib.asynccontextmanager
+    async def hold_tags(self, guild_id: int):
+        """Writes a guild's pending uses and holds back any more writes until exiting."""
+
+        await self.uses.flush(guild_id)
+
+        async with self.uses.lock(guild_id), self.lock(guild_id):
+            yield
+
+    async def cog_unload(self) -> None:
+        self.bot.storage.holds.pop("tags", None)
+        self.flush_uses.stop()
+        await self.uses.close()
+
+    @tasks.loop(seconds=30)
+    async def flush_uses(self) -> None:
+        await self.uses.flush_all()
+
+    async def write_uses(self, guild_id: int, pending: dict[int, int]) -> None:
+        await self.collection(guild_id).bulk_write(
+            [UpdateOne({"_id": tag_id}, {"$inc": {"uses": uses}}) for tag_id, uses in pending.items()],
+            ordered=False,
+        )
+
+        # Cached tags would otherwise lose these uses from their count.
+        for tag_id, uses in pending.items():
+            tag = self.cache.peek(guild_id, tag_id)
+
+            if tag is not None:
+                tag["uses"] = tag.get("uses", 0) + uses
+
+    async def load_names(self, guild_id: int):
+        cursor = self.collection(guild_id).find({}, {"name": 1, "_id": 0})
+
+        with self.bot.budgets.track("Tags.load_names"):
+            async for tag in cursor:
+                yield tag["name"]
+
+    async def get_tag(self, guild_id: int, name: str, *, by_id: bool = True) -> dict | None:
+        """
+        A tag by its name in any case or, failing that, by its ID.
+
+        Both are looked up in a single query. A tag whose name matches
+        exactly wins over one that only differs in case, and either wins
+        over an ID.
+        """
+
+        tag_id = int(name) if by_id and name.isdigit() else None
+        names = self.names.peek(guild_id)
+        # A tag named `name` would win over the ID, and it may not be cached.
+        ruled_out = names is not None and name not in names
+        tag = self.cache.get(guild_id, name, tag_id=tag_id if ruled_out else None)
+
+        if tag is not None:
+            return tag
+
+        query = {"name": name} if tag_id is None else {"$or": [{"name": name}, {"_id": tag_id}]}
+        cursor = self.collection(guild_id).find(query, collation=NAME_COLLATION).limit(5)
+        tags = await cursor.to_list(5)
+
+        if not tags:
+            return None
+
+        folded = name.casefold()
+        tag = min(tags, key=lambda tag: (tag["name"] != name, tag["name"].casefold() != folded))
+        self.cache.set(guild_id, tag)
+
+        return tag
 
     @property
     def emoji(self) -> str:
@@ -24,22 +123,35 @@ class Tags(commands.Cog):
         return ctx.guild is not None
 
     @commands.group(name="tag", invoke_without_command=True, case_insensitive=True)
-    async def tag(self, ctx: commands.Context, name: Union[str, int] = None) -> None:
+    async def tag(self, ctx: commands.Context, name: Union[str, int] = None, *args: str) -> None:
 
-        """Sends help for the tag group, sends a tag's content if an argument was passed."""
+        """
+        Sends help for the tag group, sends a tag's content if an argument was passed.
 
-        if name is not None:
-            db = self.db[str(ctx.guild.id)]
+        Anything after the name is available to the tag as `{args}`, `{args.1}` and so on.
+        """
 
-            tag = await db.find_one({"name": name}) or await db.find_one({"_id": name})
-            
+        if name is not None:
+            tag = await self.get_tag(ctx.guild.id, str(name))
 
             if tag is not None:
-                engine = TagEngine(ctx)
+                unwritten = self.uses.get(ctx.guild.id, tag["_id"])
+                self.uses.add(ctx.guild.id, tag["_id"], 1)
+                self.popular.record(ctx.guild.id, tag, unwritten=unwritten)
+
+                engine = TagEngine(ctx, args=args)
                 return await ctx.send(engine.substitute(tag["content"]))
 
             elif tag is None:
-                return await ctx.send(f"A tag with the name `{name}` does not exist.")
+                suggestions = await self.names.suggest(ctx.guild.id, str(name))
+                message = f"A tag with the name `{name}` does not exist."
+
+                if suggestions:
+                    message += " Did you mean " + ", ".join(
+                        f"`{suggestion}`" for suggestion in suggestions
+                    ) + "?"
+
+                return await ctx.send(message, allowed_mentions=discord.AllowedMentions.none())
 
         if name is None:
             await ctx.send_help("tag")
@@ -49,22 +161,28 @@ class Tags(commands.Cog):
 
         """Create a tag."""
 
-        db = self.db[str(ctx.guild.id)]
-        tag = await db.find_one({"name": name})
-        tag_id = len(await db.find().to_list(10000)) + 1
-
-        if tag is not None:
-            return await ctx.send("A tag with this name already exists.")
-
-        tag_data = {
-            "_id": tag_id,
-            "owner": ctx.author.id,
-            "name": name,
-            "content": content,
-            "created": int(datetime.now().timestamp()),
-        }
-
-        await db.insert_one(tag_data)
+        # The name set rules out most names without a query.
+        if await self.names.contains(ctx.guild.id, name):
+            if await self.get_tag(ctx.guild.id, name, by_id=False) is not None:
+                return await ctx.send("A tag with this name already exists.")
+
+        async with self.lock(ctx.guild.id):
+            db = self.collection(ctx.guild.id)
+            tag_data = {
+                "_id": await self.ids.allocate(ctx.guild.id, db),
+                "owner": ctx.author.id,
+                "name": name,
+                "content": content,
+                "created": int(datetime.now().timestamp()),
+            }
+
+            try:
+                await db.insert_one(tag_data)
+            except DuplicateKeyError:
+                return await ctx.send("A tag with this name already exists.")
+
+        self.names.add(ctx.guild.id, name)
+        self.cache.set(ctx.guild.id, tag_data)
         return await ctx.send(
             f"Tag successfully created. Do `{ctx.clean_prefix}tag {name}` to view the tag!"
         )
@@ -74,9 +192,7 @@ class Tags(commands.Cog):
 
         """Get information about a tag."""
 
-        db = self.db[str(ctx.guild.id)]
-
-        tag = await db.find_one({"name": name.lower()})
+        tag = await self.get_tag(ctx.guild.id, name)
 
         if tag is not None:
             owner = self.bot.get_user(tag["owner"]) or await self.bot.fetch_user(
@@ -96,8 +212,7 @@ class Tags(commands.Cog):
 
         """Edits a tag."""
 
-        db = self.db[str(ctx.guild.id)]
-        tag = await db.find_one({"name": name})
+        tag = await self.get_tag(ctx.guild.id, name)
 
         if tag is None:
             return await ctx.send("A tag with that name does not exist!")
@@ -105,53 +220,194 @@ class Tags(commands.Cog):
         if ctx.author.id != tag["owner"]:
             return await ctx.send("You do not own this tag.")
 
-        await self.db.update_one({"name": name}, {"$set": {"content": content}})
+        async with self.lock(ctx.guild.id):
+            await self.collection(ctx.guild.id).update_one(
+                {"_id": tag["_id"]}, {"$set": {"content": content}}
+            )
+
+        self.cache.set(ctx.guild.id, {**tag, "content": content})
 
         await ctx.send(
             f"tag successfully edited! Do `{ctx.clean_prefix}tag {name}` to view the tag."
         )
 
     @tag.command(name="all", aliases=("list",))
-    async def all(self, ctx: commands.Context) -> None:
+    async def all(
+        self,
+        ctx: commands.Context,
+        owner: Optional[discord.Member] = None,
+        *,
+        prefix: str = None,
+    ) -> None:
+
+        """Get all the tags in the current server, optionally only an owner's or those starting with a prefix."""
+
+        db = self.collection(ctx.guild.id)
+        query = {}
+        per_page = 25
+
+        if owner is not None:
+            query["owner"] = owner.id
+
+        if prefix:
+            query["name"] = {"$regex": f"^{re.escape(prefix)}"}
+
+        total = await db.count_documents(query)
+
+        if total == 0:
+            return await ctx.send("There are no tags matching that in this server.")
+
+        async def fetch(*, after: str = None, before: str = None, skip: int = 0) -> list[str]:
+            # Pages are found from the names around them, so only the names
+            # on the page are read.
+            names = dict(query.get("name", {}))
+
+            if after is not None:
+                names["$gt"] = after
+            if before is not None:
+                names["$lt"] = before
+
+            cursor = (
+                db.find({**query, "name": names} if names else query, {"name": 1, "_id": 0})
+                .sort("name", -1 if before is not None else 1)
+                .skip(skip)
+                .limit(per_page)
+            )
+            page = [tag["name"] async for tag in cursor]
+            return page[::-1] if before is not None else page
+
+        def format(names: list[str], page: int, pages: int) -> str:
+            lines = "\n".join(name if len(name) <= 60 else f"{name[:59]}…" for name in names)
+            return (
+                f"```\nTags for {ctx.guild.name} | Page {page + 1}/{pages} | Total tags: {total}\n"
+                + f"{'-' * 60}\n{lines}```"
+            )
 
-        """Get all the tags in the current server."""
+        view = KeysetPaginator(ctx, fetch, format, total=total, per_page=per_page)
+        view.msg = await ctx.send(await view.get_page(0), view=view)
 
-        db = self.db[str(ctx.guild.id)]
-        tags = []
+    @tag.command(name="export")
+    @commands.cooldown(1, 60, commands.BucketType.guild)
+    async def export(self, ctx: commands.Context) -> None:
 
-        async for tag in db.find():
-            tags.append(tag["name"])
+        """Get every tag in the current server as a file that `tag import` takes."""
 
-        if len(tags) == 0:
-            return await ctx.send("There are no tags in this server.")
+        await self.uses.flush(ctx.guild.id)
+        cursor = (
+            self.collection(ctx.guild.id)
+            .find({}, {"name": 1, "content": 1, "owner": 1, "created": 1, "uses": 1})
+            .sort("_id", 1)
+        )
 
-        await ctx.send(
-            f'```\nTags for {ctx.guild.name} | ID: {ctx.guild.id} | Total tags: {len(tags)}\n------------------------------------------------------------------------\n{", ".join(tags)}```'
+        async with ctx.typing():
+            file = await export_tags(cursor)
+
+            with file:
+                return await ctx.send(
+                    file=discord.File(file, filename=f"tags-{ctx.guild.id}.jsonl")
+                )
+
+    @tag.command(name="import")
+    @commands.has_permissions(manage_guild=True)
+    @commands.cooldown(1, 60, commands.BucketType.guild)
+    async def import_(self, ctx: commands.Context, policy: str = "skip") -> None:
+
+        """
+        Import tags from an attached JSONL or CSV file, like the one `tag export` sends.
+
+        Tags whose name is already taken are skipped, or with `overwrite` or `rename` replaced or renamed to `name-2`.
+        """
+
+        policy = policy.lower()
+
+        if policy not in POLICIES:
+            return await ctx.send(f"Pick one of {', '.join(f'`{policy}`' for policy in POLICIES)}.")
+
+        if not ctx.message.attachments:
+            return await ctx.send("Attach the file to import.")
+
+        attachment = ctx.message.attachments[0]
+        format = "csv" if attachment.filename.lower().endswith(".csv") else "jsonl"
+
+        async with ctx.typing(), self.lock(ctx.guild.id):
+            # Read line by line, so the file is never held in memory at once.
+            async with self.bot.session.get(attachment.url) as resp:
+                result = await import_tags(
+                    read_rows(resp.content, format),
+                    self.collection(ctx.guild.id),
+                    ctx.guild.id,
+                    names=self.names,
+                    allocate=lambda count: self.ids.allocate(
+                        ctx.guild.id, self.collection(ctx.guild.id), count
+                    ),
+                    owner=ctx.author.id,
+                    policy=policy,
+                )
+
+        if result["overwritten"] or result["failed"]:
+            self.cache.invalidate_guild(ctx.guild.id)
+
+        await ctx.reply(
+            ", ".join(f"{count:,} {outcome}" for outcome, count in result.items() if count)
+            or "There were no tags in that file."
         )
-        # i don't know any other way to do this without making it long
 
     @tag.command(name="delete", aliases=("remove",))
     async def delete(self, ctx: commands.Context, *, name: str) -> None:
 
         """Delete a tag."""
 
-        db = self.db[str(ctx.guild.id)]
-
-        tag = await db.find_one({"name": name})
+        tag = await self.get_tag(ctx.guild.id, name)
 
         if tag is not None:
             if tag["owner"] == ctx.author.id:
-                return await db.delete_one({"name": tag["name"]})
+                async with self.lock(ctx.guild.id):
+                    await self.collection(ctx.guild.id).delete_one({"_id": tag["_id"]})
+
+                self.cache.invalidate(ctx.guild.id, tag["_id"])
+                self.names.remove(ctx.guild.id, tag["name"])
+                self.popular.remove(ctx.guild.id, tag["_id"])
+                return await ctx.reply("Tag successfully deleted.")
 
             return await ctx.reply("You do not own this tag.")
 
         if tag is None:
             return await ctx.reply("A tag with this name does not exist.")
 
+    @tag.command(name="top", aliases=("popular",))
+    async def top_tags(self, ctx: commands.Context) -> None:
+
+        """Shows the most used tags in the current server."""
+
+        if not self.popular.loaded(ctx.guild.id):
+            # Seeded once from the database, then kept up to date in memory.
+            await self.uses.flush(ctx.guild.id)
+            cursor = (
+                self.collection(ctx.guild.id)
+                .find({"uses": {"$gt": 0}}, {"name": 1, "uses": 1})
+                .sort("uses", -1)
+                .limit(self.popular.capacity)
+            )
+            self.popular.load(ctx.guild.id, await cursor.to_list(self.popular.capacity))
+
+        tags = self.popular.top(ctx.guild.id)
+
+        if not tags:
+            return await ctx.send("No tags have been used in this server yet.")
+
+        lines = "\n".join(
+            f"{index}. {name} ({uses:,} uses)" for index, (name, uses) in enumerate(tags, 1)
+        )
+        await ctx.send(f"```\nMost used tags in {ctx.guild.name}\n{'-' * 40}\n{lines}```")
+
     @tag.command(name="variables", aliases=("vars", "substitutes"))
     async def variables(self, ctx: commands.Context):
         engine = TagEngine(ctx)
-        embed = discord.Embed(title="Variables", description="\n".join(engine.substitutes.keys()))
+        embed = discord.Embed(
+            title="Variables",
+            description="\n".join(f"`{{{name}}}`" for name in engine.substitutes),
+        )
+        await ctx.send(embed=embed)
         
     @commands.Cog.listener("on_message")
     async def send_tag(self, message: discord.Message) -> None:
@@ -159,30 +415,31 @@ class Tags(commands.Cog):
         if isinstance(message.channel, discord.DMChannel):
             return await self.bot.process_commands(message)
 
-        ctx = await self.bot.get_context(message)
+        with self.bot.budgets.track("Tags.send_tag"):
+            ctx = await self.bot.get_context(message)
 
-        db = self.db[str(ctx.guild.id)]
+            if (
+                ctx.invoked_with
+                and ctx.invoked_with.lower() not in self.bot.commands
+                and ctx.command is None
+            ):
 
-        if (
-            ctx.invoked_with
-            and ctx.invoked_with.lower() not in self.bot.commands
-            and ctx.command is None
-        ):
+                msg = copy.copy(message)
 
-            msg = copy.copy(message)
+                if ctx.prefix:
+                    new_content = msg.content[len(ctx.prefix) :]
 
-            if ctx.prefix:
-                new_content = msg.content[len(ctx.prefix) :]
-                tag = await db.find_one({"name": new_content}) or await db.find_one(
-                    {"name": new_content.lower()}
-                )
+                    if not await self.names.contains(ctx.guild.id, new_content):
+                        return await self.bot.process_commands(msg)
+
+                    tag = await self.get_tag(ctx.guild.id, new_content, by_id=False)
 
-                if tag is None:
-                    return await self.bot.process_commands(msg)
+                    if tag is None:
+                        return await self.bot.process_commands(msg)
 
-                msg.content = f"{ctx.prefix}tag {new_content}"
+                    msg.content = f"{ctx.prefix}tag {new_content}"
 
-                await self.bot.process_commands(msg)
+                    await self.bot.process_commands(msg)
 
 
 async def setup(bot: Bonbons) -> None:
@@ -1,19 +1,61 @@
+import asyncio
 import os
 import random
 import re
 import time
 
+import aiohttp
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 from helpers.bot import Bonbons
 from helpers.constants import FAIL_REPLIES, REPLIES
+from helpers.rtfm import InventoryCache
 from helpers.utils import RTFMView, SphinxObjectFileReader
 
+RTFM_PAGES = {
+    "python": "https://docs.python.org/3",
+    "discord": "https://discord.readthedocs.io/en/latest",
+    "nextcord": "https://nextcord.readthedocs.io/en/latest",
+    "discord.py": "https://discordpy.readthedocs.io/en/master",
+    "pycord": "https://docs.pycord.dev/en/master/",
+}
+
 
 class Useful(commands.Cog, description="Commands that I think are useful to me."):
     def __init__(self, bot):
         self.bot = bot
+        self.inventories = InventoryCache(".cache/rtfm.pickle")
+        # Projects being fetched, so concurrent lookups share one download.
+        self._rtfm_builds: dict[str, asyncio.Task] = {}
+
+    async def cog_load(self) -> None:
+        # Inventories from the last run answer straight away, the refresh
+        # only downloads those that changed since.
+        await asyncio.to_thread(self.inventories.load)
+        self.refresh_rtfm.start()
+
+    async def cog_unload(self) -> None:
+        self.refresh_rtfm.cancel()
+
+        for task in self._rtfm_builds.values():
+            task.cancel()
+
+    @tasks.loop(hours=6)
+    async def refresh_rtfm(self) -> None:
+        # Only projects someone has looked something up in, the rest are
+        # fetched the first time they are asked for.
+        failures = await self.build_rtfm_lookup_table(
+            {key: page for key, page in RTFM_PAGES.items() if key in self.inventories}
+        )
+
+        for key, err in failures.items():
+            print(f"Failed to refresh the {key} rtfm inventory: {err!r}")
+
+    @refresh_rtfm.before_loop
+    async def before_refresh_rtfm(self) -> None:
+        # The HTTP session is only opened once the bot is ready.
+        await self.bot.wait_until_ready()
 
     @property
     def emoji(self) -> str:
@@ -99,36 +141,85 @@ class Useful(commands.Cog, description="Commands that I think are useful to me."
 
         return result
 
-    async def build_rtfm_lookup_table(self, page_types: dict) -> None:
-        cache = {}
+    async def build_rtfm_inventory(self, key: str, page: str) -> bool:
+        """Fetches one project's inventory, returns whether it changed."""
+
+        # Builds can be started before the session is opened, once ready.
+        await self.bot.wait_until_ready()
+
+        async with self.bot.session.get(
+            f"{page}/objects.inv",
+            headers=self.inventories.headers(key, page),
+            timeout=aiohttp.ClientTimeout(total=30),
+        ) as resp:
+            if resp.status == 304:
+                self.inventories.unchanged()
+                return False
+
+            if resp.status != 200:
+                raise RuntimeError(
+                    f"Cannot build the {key} rtfm lookup table, try again later."
+                )
+
+            stream = SphinxObjectFileReader(await resp.read())
+            self.inventories.set(
+                key,
+                page,
+                await asyncio.to_thread(self.parse_object_inv, stream, page),
+                etag=resp.headers.get("ETag"),
+                last_modified=resp.headers.get("Last-Modified"),
+            )
+            return True
+
+    async def build_rtfm_lookup_table(self, page_types: dict) -> dict[str, BaseException]:
+        """
+        Fetches the given projects' inventories at the same time.
+
+        A project that is already being fetched is waited on instead of
+        fetched twice. A project that fails doesn't stop the others, its
+        error is returned by project and it keeps the inventory it had.
+        """
+
+        builds = []
+
         for key, page in page_types.items():
-            async with self.bot.session.get(f"{page}/objects.inv") as resp:
-                if resp.status != 200:
-                    raise RuntimeError(
-                        "Cannot build rtfm lookup table, try again later."
-                    )
+            task = self._rtfm_builds.get(key)
 
-                stream = SphinxObjectFileReader(await resp.read())
-                cache[key] = self.parse_object_inv(stream, page)
+            if task is None:
+                task = self._rtfm_builds[key] = asyncio.create_task(
+                    self.build_rtfm_inventory(key, page)
+                )
+                task.add_done_callback(lambda _, key=key: self._rtfm_builds.pop(key, None))
 
-        self._rtfm_cache = cache
+            builds.append(task)
 
-    async def do_rtfm(self, ctx: commands.Context, key: str, obj: str) -> None:
+        # Shielded, so a cancelled command doesn't cancel a fetch others wait on.
+        results = await asyncio.gather(
+            *(asyncio.shield(task) for task in builds), return_exceptions=True
+        )
 
-        page_types = {
-            "python": "https://docs.python.org/3",
-            "discord": "https://discord.readthedocs.io/en/latest",
-            "nextcord": "https://nextcord.readthedocs.io/en/latest",
-            "discord.py": "https://discordpy.readthedocs.io/en/master",
-            "pycord": "https://docs.pycord.dev/en/master/",
+        if any(result is True for result in results):
+            await asyncio.to_thread(self.inventories.save)
+
+        return {
+            key: result
+            for key, result in zip(page_types, results)
+            if isinstance(result, BaseException)
         }
 
+    async def do_rtfm(self, ctx: commands.Context, key: str, obj: str) -> None:
+
         if obj is None:
-            return await ctx.send(page_types[key])
+            return await ctx.send(RTFM_PAGES[key])
 
-        if not hasattr(self, "_rtfm_cache"):
+        if key not in self.inventories:
             await ctx.trigger_typing()
-            await self.build_rtfm_lookup_table(page_types)
+            await self.build_rtfm_lookup_table({key: RTFM_PAGES[key]})
+
+            if key not in self.inventories:
+                return await self.send_error_message(
+                    ctx, f"Couldn't reach the {key} documentation, try again later."
+                )
 
         obj = re.sub(r"^(?:discord\.(?:ext\.)?)?(?:commands\.)?(.+)", r"\1", obj)
 
@@ -141,7 +232,7 @@ class Useful(commands.Cog, description="Commands that I think are useful to me."
                     obj = f"abc.Messageable.{name}"
                     break
 
-        cache = list(self._rtfm_cache[key].items())
+        cache = list(self.inventories[key].items())
 
         matches = self.finder(obj, cache, key=lambda t: t[0], lazy=False)[:8]
 
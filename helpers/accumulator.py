@@ -0,0 +1,136 @@
+import asyncio
+from typing import Awaitable, Callable
+
+from pymongo.errors import BulkWriteError
+
+Writer = Callable[[int, dict[int, int]], Awaitable[None]]
+
+
+class Accumulator:
+
+    """
+    Buffers counters in memory and writes them back in batches.
+
+    Amounts are summed per (guild, key), like XP per member or uses per tag,
+    until the guild is flushed, either by the owner on a timer or
+    automatically once a guild has `max_pending` keys waiting. A flush hands
+    the whole guild to `writer`, which is expected to apply it with a single
+    bulk write of one operation per key, in the order given. If that write
+    partly fails, only the keys whose operations failed are put back.
+
+    Usage:
+    ```py
+    >>> accumulator = Accumulator(writer, max_pending=500, name="XP")
+    >>> accumulator.add(guild_id, user_id, 120)
+    >>> await accumulator.flush_all()
+    ```
+    """
+
+    def __init__(self, writer: Writer, *, max_pending: int = 500, name: str = "counts") -> None:
+        self.writer = writer
+        self.max_pending = max_pending
+        self.name = name
+
+        self._pending: dict[int, dict[int, int]] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._tasks: dict[int, asyncio.Task] = {}
+
+        self.flushed: int = 0
+        self.flushes: int = 0
+        self.failures: int = 0
+
+    @property
+    def pending(self) -> int:
+        return sum(len(pending) for pending in self._pending.values())
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "pending": self.pending,
+            "guilds": len(self._pending),
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "failures": self.failures,
+        }
+
+    def get(self, guild_id: int, key: int) -> int:
+        """How much is waiting to be written for `key`."""
+        return self._pending.get(guild_id, {}).get(key, 0)
+
+    def add(self, guild_id: int, key: int, amount: int) -> None:
+        pending = self._pending.setdefault(guild_id, {})
+        pending[key] = pending.get(key, 0) + amount
+
+        if len(pending) >= self.max_pending and guild_id not in self._tasks:
+            task = asyncio.create_task(self._safe_flush(guild_id))
+            self._tasks[guild_id] = task
+            task.add_done_callback(lambda _: self._tasks.pop(guild_id, None))
+
+    def lock(self, guild_id: int) -> asyncio.Lock:
+        """The lock held while a guild is being flushed."""
+        return self._locks.setdefault(guild_id, asyncio.Lock())
+
+    async def flush(self, guild_id: int) -> None:
+        async with self.lock(guild_id):
+            pending = self._pending.pop(guild_id, None)
+
+            if not pending:
+                return
+
+            try:
+                await self.writer(guild_id, pending)
+            except BulkWriteError as err:
+                self.failures += 1
+                # The writes that went through must not be applied twice.
+                failed = {error["index"] for error in err.details.get("writeErrors", ())}
+                self._requeue(
+                    guild_id,
+                    {
+                        key: amount
+                        for index, (key, amount) in enumerate(pending.items())
+                        if index in failed
+                    },
+                )
+                raise
+            except Exception:
+                self.failures += 1
+                # Put the amounts back so the next flush retries them.
+                self._requeue(guild_id, pending)
+                raise
+
+            self.flushes += 1
+            self.flushed += len(pending)
+
+    def _requeue(self, guild_id: int, amounts: dict[int, int]) -> None:
+        pending = self._pending.setdefault(guild_id, {})
+
+        for key, amount in amounts.items():
+            pending[key] = pending.get(key, 0) + amount
+
+    async def _safe_flush(self, guild_id: int) -> None:
+        try:
+            await self.flush(guild_id)
+        except Exception as err:
+            print(f"Failed to flush {self.name} for guild {guild_id}: {err}")
+
+    async def flush_all(self, *, skip_busy: bool = True) -> None:
+        """
+        Flushes every guild with anything pending.
+
+        Guilds whose lock is held, by a flush or a long scan like loading the
+        rank index, are left for the next call rather than holding up the rest.
+        """
+
+        await asyncio.gather(
+            *(
+                self._safe_flush(guild_id)
+                for guild_id in tuple(self._pending)
+                if not (skip_busy and self.lock(guild_id).locked())
+            )
+        )
+
+    async def close(self) -> None:
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+        await self.flush_all(skip_busy=False)
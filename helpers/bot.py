@@ -1,3 +1,4 @@
+import asyncio
 import os
 
 import discord
@@ -5,9 +6,14 @@ from aiohttp import ClientSession
 from discord.ext import commands
 from motor.motor_asyncio import AsyncIOMotorClient
 
+from helpers.budgets import QueryBudget
 from helpers.constants import Config
+from helpers.indexes import IndexManager
+from helpers.storage import Storage
 
 EXTENSIONS = (f"cogs.{ext[:-3]}" for ext in os.listdir("./cogs") if ext.endswith(".py"))
+# Databases holding one collection per guild, or a shared one once migrated.
+DATABASES = ("levels", "tags")
 
 
 class Bonbons(commands.Bot):
@@ -22,13 +28,20 @@ class Bonbons(commands.Bot):
         self.uptime: int = int(discord.utils.utcnow().timestamp())
         self.ignored_cogs: list[str] = ["Jishaku", "Owner", "Help"]
         self.owner_ids = {656073353215344650, 669794921883893776}
+        self.indexes = IndexManager()
+        self.budgets = QueryBudget(strict=os.environ.get("DB_BUDGETS") == "strict")
+        self.before_invoke(self.open_budget)
+        self.after_invoke(self.close_budget)
 
     async def start(self) -> None:
         await super().start(Config.TOKEN)
 
     async def setup_hook(self) -> None:
 
-        self.mongo = AsyncIOMotorClient(Config.MONGO)
+        self.mongo = AsyncIOMotorClient(Config.MONGO, event_listeners=[self.budgets])
+        self.storage = Storage(self.mongo, self.indexes, mode=os.environ.get("STORAGE_MODE", "shared"))
+        await self.storage.load(DATABASES)
+        self.index_backfill = asyncio.create_task(self.indexes.backfill(self.mongo, DATABASES))
 
         os.environ["JISHAKU_NO_DM_TRACEBACK"] = "True"
         os.environ["JISHAKU_NO_UNDERSCORE"] = "True"
@@ -42,6 +55,14 @@ class Bonbons(commands.Bot):
             except Exception as err:
                 print(f"Failed to load extension {extension}: {err}")
 
+    async def open_budget(self, ctx: commands.Context) -> None:
+        # In the invoke hooks, which run for the command that is actually
+        # called, `tag create` rather than the `tag` group it was found under.
+        ctx.budget = self.budgets.open(ctx.command.qualified_name)
+
+    async def close_budget(self, ctx: commands.Context) -> None:
+        self.budgets.close(ctx.budget)
+
     async def on_ready(self) -> None:
 
         if not hasattr(self, "session"):
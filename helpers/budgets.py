@@ -0,0 +1,190 @@
+import contextlib
+import contextvars
+import threading
+from collections import deque
+from typing import Iterator, NamedTuple
+
+from pymongo import monitoring
+
+
+class Budget(NamedTuple):
+    # None means unbounded.
+    round_trips: int | None
+    documents: int | None
+
+
+# How much Mongo each command and listener may use per call. Paths without a
+# budget are still counted, see `QueryBudget.stats`.
+BUDGETS: dict[str, Budget] = {
+    "Levels.handle_message": Budget(0, 0),
+    # A pending XP flush.
+    "rank": Budget(1, 0),
+    "leaderboard": Budget(1, 0),
+    "leaderboard export": Budget(None, None),
+    "Levels.load_ranks": Budget(None, None),
+    # One query for the name in any case or the ID, a few documents when
+    # names only differ in case.
+    "tag": Budget(1, 5),
+    "Tags.send_tag": Budget(1, 5),
+    "Tags.load_names": Budget(None, None),
+    # A name check when the name set can't rule it out, the ID and the insert.
+    # A guild's first ID also seeds its counter from the highest tag ID, which
+    # is three more round trips.
+    "tag create": Budget(6, 7),
+    # A count, which comes back as a document, and the first page of names.
+    "tag all": Budget(2, 26),
+    # Pending uses and the seed, only the first time a server asks.
+    "tag top": Budget(2, 20),
+    # Whole servers, streamed in batches.
+    "tag export": Budget(None, None),
+    "tag import": Budget(None, None),
+}
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class Usage:
+
+    __slots__ = ("path", "round_trips", "documents", "open", "token")
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.round_trips = 0
+        self.documents = 0
+        self.open = True
+        self.token: contextvars.Token | None = None
+
+
+_usage: contextvars.ContextVar[Usage | None] = contextvars.ContextVar("usage", default=None)
+
+
+def _documents(reply: dict) -> int:
+    cursor = reply.get("cursor")
+
+    if cursor is not None:
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", ())))
+
+    if reply.get("value") is not None:
+        return 1
+
+    return 0
+
+
+class QueryBudget(monitoring.CommandListener):
+
+    """
+    Counts the Mongo round trips and returned documents of every command and
+    listener, and reports the ones that go over their budget.
+
+    Register it with the client, then wrap each path in `track`, or in `open`
+    and `close` when it starts and ends in separate callbacks. Motor runs
+    operations with a copy of the caller's context, so commands are charged
+    to whichever path started them. Work that outlives a path, like a
+    background flush it scheduled, isn't charged to it. With `strict`,
+    going over a budget raises `BudgetExceeded` instead of only logging it,
+    which is how a local run against a test database is checked.
+
+    Usage:
+    ```py
+    >>> budget = QueryBudget()
+    >>> client = AsyncIOMotorClient(uri, event_listeners=[budget])
+    >>> with budget.track("Tags.send_tag"):
+    ...     await db.find_one({"name": name})
+    ```
+    """
+
+    def __init__(self, budgets: dict[str, Budget] = BUDGETS, *, strict: bool = False) -> None:
+        self.budgets = budgets
+        self.strict = strict
+        self.violations: deque[str] = deque(maxlen=100)
+
+        # path: [calls, round trips, documents, most round trips, most documents]
+        self._stats: dict[str, list[int]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {
+            path: dict(
+                zip(("calls", "round_trips", "documents", "max_round_trips", "max_documents"), stats)
+            )
+            for path, stats in self._stats.items()
+        }
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        usage = _usage.get()
+
+        if usage is not None and usage.open:
+            with self._lock:
+                usage.round_trips += 1
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        usage = _usage.get()
+
+        if usage is not None and usage.open:
+            with self._lock:
+                usage.documents += _documents(event.reply)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        pass
+
+    @contextlib.contextmanager
+    def track(self, path: str) -> Iterator[Usage]:
+        usage = self.open(path)
+
+        try:
+            yield usage
+        finally:
+            self._stop(usage)
+
+        self.record(usage)
+
+    def open(self, path: str) -> Usage:
+        """Charges what runs in the current context to `path` until `close`."""
+
+        usage = Usage(path)
+        usage.token = _usage.set(usage)
+        return usage
+
+    def close(self, usage: Usage) -> None:
+        self._stop(usage)
+        self.record(usage)
+
+    def _stop(self, usage: Usage) -> None:
+        usage.open = False
+        _usage.reset(usage.token)
+
+    def record(self, usage: Usage) -> None:
+        stats = self._stats.setdefault(usage.path, [0, 0, 0, 0, 0])
+        stats[0] += 1
+        stats[1] += usage.round_trips
+        stats[2] += usage.documents
+        stats[3] = max(stats[3], usage.round_trips)
+        stats[4] = max(stats[4], usage.documents)
+
+        budget = self.budgets.get(usage.path)
+
+        if budget is None:
+            return
+
+        over = [
+            f"{name} {used}/{limit}"
+            for name, used, limit in (
+                ("round trips", usage.round_trips, budget.round_trips),
+                ("documents", usage.documents, budget.documents),
+            )
+            if limit is not None and used > limit
+        ]
+
+        if not over:
+            return
+
+        message = f"{usage.path} went over its database budget: {', '.join(over)}"
+        self.violations.append(message)
+
+        if self.strict:
+            raise BudgetExceeded(message)
+
+        print(message)
@@ -0,0 +1,116 @@
+import asyncio
+import contextvars
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
+
+# Compares names ignoring case, queries must use it to use the indexes below.
+NAME_COLLATION = {"locale": "en", "strength": 2}
+
+# The indexes every per-guild collection needs, by database name, and those of
+# the shared collections, by their full name.
+INDEXES: dict[str, list[IndexModel]] = {
+    "levels": [
+        IndexModel([("level", DESCENDING), ("xp", DESCENDING)], name="level_xp"),
+    ],
+    "tags": [
+        IndexModel([("name", ASCENDING)], name="name", unique=True),
+        IndexModel([("owner", ASCENDING), ("name", ASCENDING)], name="owner_name"),
+        IndexModel([("name", ASCENDING)], name="name_ci", collation=NAME_COLLATION),
+        IndexModel([("uses", DESCENDING)], name="uses"),
+    ],
+    "levels.shared": [
+        IndexModel([("guild_id", ASCENDING), ("key", ASCENDING)], name="guild_key", unique=True),
+        IndexModel(
+            [("guild_id", ASCENDING), ("level", DESCENDING), ("xp", DESCENDING)],
+            name="guild_level_xp",
+        ),
+    ],
+    "tags.shared": [
+        IndexModel([("guild_id", ASCENDING), ("key", ASCENDING)], name="guild_key", unique=True),
+        IndexModel([("guild_id", ASCENDING), ("name", ASCENDING)], name="guild_name", unique=True),
+        IndexModel(
+            [("guild_id", ASCENDING), ("owner", ASCENDING), ("name", ASCENDING)],
+            name="guild_owner_name",
+        ),
+        IndexModel(
+            [("guild_id", ASCENDING), ("name", ASCENDING)],
+            name="guild_name_ci",
+            collation=NAME_COLLATION,
+        ),
+        IndexModel([("guild_id", ASCENDING), ("uses", DESCENDING)], name="guild_uses"),
+    ],
+}
+
+
+class IndexManager:
+
+    """
+    Makes sure per-guild collections have their indexes.
+
+    `ensure` is cheap enough to call every time a collection is used: the
+    first call for a collection creates its indexes in the background and
+    every later call is a set lookup.
+
+    Usage:
+    ```py
+    >>> bot.indexes.ensure(bot.mongo["tags"][str(guild.id)])
+    >>> await bot.indexes.backfill(bot.mongo, ("levels", "tags"))
+    ```
+    """
+
+    def __init__(self, indexes: dict[str, list[IndexModel]] = INDEXES) -> None:
+        self.indexes = indexes
+        self._ensured: set[str] = set()
+        self._tasks: dict[str, asyncio.Task] = {}
+        self.failures: int = 0
+
+    @staticmethod
+    def _name(collection: AsyncIOMotorCollection) -> str:
+        return f"{collection.database.name}.{collection.name}"
+
+    def ensure(self, collection: AsyncIOMotorCollection) -> None:
+        name = self._name(collection)
+
+        if name in self._ensured or name in self._tasks:
+            return
+
+        # Outside the caller's context, so the build isn't charged to whatever
+        # command first touched the collection.
+        task = contextvars.Context().run(asyncio.create_task, self.create(collection))
+        self._tasks[name] = task
+        task.add_done_callback(lambda _: self._tasks.pop(name, None))
+
+    async def create(self, collection: AsyncIOMotorCollection) -> None:
+        name = self._name(collection)
+        indexes = self.indexes.get(name, self.indexes.get(collection.database.name))
+
+        if indexes:
+            try:
+                await collection.create_indexes(indexes)
+            except PyMongoError as err:
+                # Usually existing duplicates breaking a unique index. Retrying
+                # on every message would not fix that, so don't.
+                self.failures += 1
+                print(f"Failed to create indexes for {name}: {err}")
+
+        self._ensured.add(name)
+
+    async def backfill(
+        self, client: AsyncIOMotorClient, databases: tuple[str, ...], *, concurrency: int = 4
+    ) -> None:
+        """Ensures the indexes of every existing collection in `databases`."""
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def create(collection: AsyncIOMotorCollection) -> None:
+            async with semaphore:
+                if self._name(collection) not in self._ensured:
+                    await self.create(collection)
+
+        for database in databases:
+            names = await client[database].list_collection_names()
+            await asyncio.gather(
+                *(create(client[database][name]) for name in names if name.isdigit())
+            )
@@ -0,0 +1,214 @@
+import asyncio
+import contextlib
+import functools
+import io
+import os
+from collections import OrderedDict
+
+import discord
+from PIL import Image
+
+
+class AvatarCache:
+
+    """
+    A two-tier cache of resized avatars for the level images.
+
+    Decoded images live in an in-memory LRU capped at `max_bytes`, and every
+    resized avatar is also written to `directory` as a PNG so it survives
+    restarts. The files are an LRU of their own, capped at `max_disk_bytes`
+    and indexed once by `scan`, so nothing lists the directory afterwards.
+    Entries are keyed by (avatar hash, size). A hash names one image, so
+    entries never go stale, and the owner drops a hash once it is replaced.
+
+    Usage:
+    ```py
+    >>> avatars = AvatarCache(".cache/avatars", max_bytes=32 * 1024 * 1024)
+    >>> await asyncio.to_thread(avatars.scan)
+    >>> image = await avatars.get(member, 150)
+    ```
+    """
+
+    def __init__(
+        self,
+        directory: str = ".cache/avatars",
+        *,
+        max_bytes: int = 32 * 1024 * 1024,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+    ) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        self._images: OrderedDict[tuple[str, int], Image.Image] = OrderedDict()
+        self.bytes: int = 0
+
+        # (avatar hash, size): file size, and avatar hash: sizes on disk.
+        self._files: OrderedDict[tuple[str, int], int] = OrderedDict()
+        self._sizes: dict[str, set[int]] = {}
+        self.disk_bytes: int = 0
+
+        self.hits: int = 0
+        self.disk_hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.disk_evictions: int = 0
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self._images),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "files": len(self._files),
+            "disk_bytes": self.disk_bytes,
+            "max_disk_bytes": self.max_disk_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "disk_evictions": self.disk_evictions,
+        }
+
+    def scan(self) -> None:
+        """Indexes the files left by earlier runs, oldest first. Blocks, run it in a thread."""
+
+        files = []
+
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                key, _, size = entry.name.removesuffix(".png").rpartition("_")
+
+                if not key or not size.isdigit():
+                    continue
+
+                with contextlib.suppress(OSError):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, key, int(size), stat.st_size))
+
+        for _, key, size, length in sorted(files):
+            self._track((key, size), length)
+
+        for path in self._over_disk_budget():
+            with contextlib.suppress(OSError):
+                os.remove(path)
+
+    @staticmethod
+    def _cost(image: Image.Image) -> int:
+        return image.width * image.height * len(image.getbands())
+
+    @staticmethod
+    def _fetch_size(size: int) -> int:
+        # Discord only serves powers of two between 16 and 4096.
+        return min(max(1 << (size - 1).bit_length(), 16), 4096)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def placeholder(size: int) -> Image.Image:
+        """A plain avatar used when the real one could not be fetched in time."""
+        return Image.new("RGBA", (size, size), "#494b4f")
+
+    def _path(self, key: str, size: int) -> str:
+        return os.path.join(self.directory, f"{key}_{size}.png")
+
+    def _store(self, key: tuple[str, int], image: Image.Image) -> None:
+        self._images[key] = image
+        self.bytes += self._cost(image)
+
+        while self.bytes > self.max_bytes and len(self._images) > 1:
+            _, evicted = self._images.popitem(last=False)
+            self.bytes -= self._cost(evicted)
+            self.evictions += 1
+
+    def _track(self, key: tuple[str, int], length: int) -> None:
+        self.disk_bytes += length - self._files.pop(key, 0)
+        self._files[key] = length
+        self._sizes.setdefault(key[0], set()).add(key[1])
+
+    def _untrack(self, key: tuple[str, int]) -> str:
+        self.disk_bytes -= self._files.pop(key, 0)
+        sizes = self._sizes.get(key[0])
+
+        if sizes is not None:
+            sizes.discard(key[1])
+
+            if not sizes:
+                del self._sizes[key[0]]
+
+        return self._path(*key)
+
+    def _over_disk_budget(self) -> list[str]:
+        """Untracks the least recently used files over the cap, returning their paths."""
+
+        paths = []
+
+        while self.disk_bytes > self.max_disk_bytes and len(self._files) > 1:
+            paths.append(self._untrack(next(iter(self._files))))
+            self.disk_evictions += 1
+
+        return paths
+
+    @staticmethod
+    def _remove(paths: list[str]) -> None:
+        for path in paths:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+    async def invalidate(self, key: str) -> None:
+        # Default avatars ("0" to "5") are shared by everyone, keep those.
+        if key.isdigit():
+            return
+
+        for cached in [cached for cached in self._images if cached[0] == key]:
+            self.bytes -= self._cost(self._images.pop(cached))
+
+        paths = [self._untrack((key, size)) for size in tuple(self._sizes.get(key, ()))]
+
+        if paths:
+            await asyncio.to_thread(self._remove, paths)
+
+    def _load(self, path: str) -> Image.Image | None:
+        if not os.path.exists(path):
+            return None
+
+        with Image.open(path) as image:
+            return image.convert("RGBA")
+
+    def _decode(self, data: bytes, size: int, path: str) -> tuple[Image.Image, int]:
+        with Image.open(io.BytesIO(data)) as image:
+            resized = image.convert("RGBA").resize((size, size), Image.LANCZOS)
+
+        resized.save(path, "PNG")
+        return resized, os.path.getsize(path)
+
+    async def get(self, user: discord.abc.User, size: int) -> Image.Image:
+        asset = user.display_avatar
+        key = (asset.key, size)
+        image = self._images.get(key)
+
+        if image is not None:
+            self._images.move_to_end(key)
+            self.hits += 1
+            return image
+
+        path = self._path(*key)
+        image = await asyncio.to_thread(self._load, path) if key in self._files else None
+
+        if image is not None:
+            self.disk_hits += 1
+            self._files.move_to_end(key)
+        else:
+            self.misses += 1
+            data = await asset.replace(
+                size=self._fetch_size(size), static_format="png"
+            ).read()
+            image, length = await asyncio.to_thread(self._decode, data, size, path)
+            self._track(key, length)
+
+            evicted = self._over_disk_budget()
+            if evicted:
+                await asyncio.to_thread(self._remove, evicted)
+
+        self._store(key, image)
+        return image
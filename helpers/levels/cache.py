@@ -0,0 +1,75 @@
+import hashlib
+from collections import OrderedDict
+
+
+def fingerprint(rows: list[tuple]) -> str:
+    """Hashes the ordered rows an image was drawn from."""
+    return hashlib.sha1(repr(rows).encode("utf-8")).hexdigest()
+
+
+class ImageCache:
+
+    """
+    Keeps the last rendered image of every guild, keyed by a fingerprint of
+    the data it was drawn from.
+
+    Only one image is kept per guild, and the least recently used guilds are
+    evicted once the cached images add up to more than `max_bytes`.
+
+    Usage:
+    ```py
+    >>> cache = ImageCache(max_bytes=16 * 1024 * 1024)
+    >>> key = fingerprint(rows)
+    >>> image = cache.get(guild_id, key) or render(rows)
+    >>> cache.set(guild_id, key, image)
+    ```
+    """
+
+    def __init__(self, *, max_bytes: int = 16 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self.bytes: int = 0
+
+        self._images: OrderedDict[int, tuple[str, bytes]] = OrderedDict()
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "guilds": len(self._images),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def get(self, guild_id: int, key: str) -> bytes | None:
+        cached = self._images.get(guild_id)
+
+        if cached is None or cached[0] != key:
+            self.misses += 1
+            return None
+
+        self._images.move_to_end(guild_id)
+        self.hits += 1
+        return cached[1]
+
+    def set(self, guild_id: int, key: str, image: bytes) -> None:
+        self.invalidate(guild_id)
+
+        self._images[guild_id] = (key, image)
+        self.bytes += len(image)
+
+        while self.bytes > self.max_bytes and len(self._images) > 1:
+            _, (_, evicted) = self._images.popitem(last=False)
+            self.bytes -= len(evicted)
+            self.evictions += 1
+
+    def invalidate(self, guild_id: int) -> None:
+        cached = self._images.pop(guild_id, None)
+
+        if cached is not None:
+            self.bytes -= len(cached[1])
@@ -0,0 +1,90 @@
+import time
+
+USER_BITS = 64
+
+
+class XPCooldown:
+
+    """
+    Decides whether a message may earn XP, before anything touches the database.
+
+    A member earns XP at most once per window, which defaults to `window`
+    seconds and can be set per guild. The last award of every member is
+    kept in one of two generations, each one packed int to one float. The
+    generations are rotated every `span` seconds, the longest window in use,
+    so an entry is dropped once it is at least a full span old, by which
+    point its window has passed. Members who stop talking therefore cost
+    nothing after two spans.
+
+    Usage:
+    ```py
+    >>> cooldown = XPCooldown(window=60)
+    >>> cooldown.allow(guild_id, user_id)
+    True
+    >>> cooldown.allow(guild_id, user_id)
+    False
+    ```
+    """
+
+    def __init__(self, window: float = 60, *, max_window: float = 3600) -> None:
+        self.window = window
+        self.max_window = max_window
+        self.windows: dict[int, float] = {}
+        self.span = window
+
+        self._current: dict[int, float] = {}
+        self._previous: dict[int, float] = {}
+        self._rotated = time.monotonic()
+
+        self.allowed: int = 0
+        self.dropped: int = 0
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "members": len(self._current) + len(self._previous),
+            "allowed": self.allowed,
+            "dropped": self.dropped,
+        }
+
+    def get_window(self, guild_id: int) -> float:
+        return self.windows.get(guild_id, self.window)
+
+    def set_window(self, guild_id: int, window: float | None) -> None:
+        """Sets a guild's window in seconds, None goes back to the default."""
+
+        if window is None:
+            self.windows.pop(guild_id, None)
+        else:
+            self.windows[guild_id] = min(max(window, 0), self.max_window)
+
+        self.span = max(self.window, *self.windows.values()) if self.windows else self.window
+
+    def _rotate(self, now: float) -> None:
+        if now - self._rotated < self.span:
+            return
+
+        # Two spans without a rotation means even the current generation is stale.
+        self._previous = self._current if now - self._rotated < self.span * 2 else {}
+        self._current = {}
+        self._rotated = now
+
+    def allow(self, guild_id: int, user_id: int, now: float | None = None) -> bool:
+        if now is None:
+            now = time.monotonic()
+
+        self._rotate(now)
+
+        key = (guild_id << USER_BITS) | user_id
+        last = self._current.get(key)
+
+        if last is None:
+            last = self._previous.get(key)
+
+        if last is not None and now - last < self.get_window(guild_id):
+            self.dropped += 1
+            return False
+
+        self._current[key] = now
+        self.allowed += 1
+        return True
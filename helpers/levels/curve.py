@@ -0,0 +1,103 @@
+import math
+
+
+class LevelCurve:
+
+    """
+    Maps a user's total XP to their level.
+
+    Everyone starts at level 1 with 0 XP and going from level `n` to `n + 1`
+    costs `step * (n + 1)` XP. Both directions have a closed form, so any
+    amount of XP has a level at the same cost. `max_level` is the highest
+    level that may be set by hand, its total still fits in a 64-bit integer.
+
+    Usage:
+    ```py
+    >>> curve = LevelCurve(step=125)
+    >>> curve.level(1000)
+    3
+    >>> curve.progress(1000)
+    (3, 375, 500)
+    ```
+    """
+
+    def __init__(self, step: int = 125, *, max_level: int = 100_000) -> None:
+        self.step = step
+        self.max_level = max_level
+
+    def cost(self, level: int) -> int:
+        """XP needed to go from `level` to the next one."""
+        return self.step * (level + 1)
+
+    def total(self, level: int) -> int:
+        """Total XP needed to reach `level`."""
+
+        level = max(level, 1)
+        # The sum of cost(1) to cost(level - 1).
+        return self.step * (level - 1) * (level + 2) // 2
+
+    def level(self, xp: int) -> int:
+        # The largest level with (level - 1) * (level + 2) <= 2 * xp / step,
+        # which only depends on the whole part of 2 * xp / step.
+        quotient = 2 * max(int(xp), 0) // self.step
+        return (math.isqrt(4 * quotient + 9) - 1) // 2
+
+    def progress(self, xp: int) -> tuple[int, int, int]:
+        """The level for `xp`, the XP earned into it and the XP needed to finish it."""
+
+        level = self.level(xp)
+        return level, xp - self.total(level), self.cost(level)
+
+    def total_xp(self, document: dict) -> int:
+        """
+        Total XP of a level document.
+
+        Documents written before the cumulative model stored the XP earned
+        into the current level instead, they are told apart by `v`.
+        """
+
+        xp = int(document.get("xp", 0))
+
+        if document.get("v") == 2:
+            return xp
+
+        return self.total(int(document.get("level", 1))) + xp
+
+    def mql_total(self, level) -> dict:
+        """A MongoDB expression for `total(level)`."""
+
+        # The closed form of the sum: step * (level - 1) * (level + 2) / 2.
+        return {
+            "$let": {
+                "vars": {"level": level},
+                "in": {
+                    "$divide": [
+                        {
+                            "$multiply": [
+                                self.step,
+                                {"$subtract": ["$$level", 1]},
+                                {"$add": ["$$level", 2]},
+                            ]
+                        },
+                        2,
+                    ]
+                },
+            }
+        }
+
+    def mql_level(self, xp) -> dict:
+        """A MongoDB expression for `level(xp)`."""
+
+        # The largest level with total(level) <= xp, from the quadratic formula.
+        # 8 * xp / step stays exact for thresholds, so the square root is too.
+        discriminant = {
+            "$add": [9, {"$divide": [{"$multiply": [8, xp]}, self.step]}]
+        }
+
+        return {
+            "$toInt": {
+                "$floor": {
+                    "$divide": [{"$subtract": [{"$sqrt": discriminant}, 1]}, 2]
+                }
+            }
+        }
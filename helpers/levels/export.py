@@ -0,0 +1,109 @@
+import csv
+import heapq
+import io
+import json
+import tempfile
+from typing import Any, AsyncIterator, Callable
+
+from motor.motor_asyncio import AsyncIOMotorCursor
+
+# Discord IDs are at most 20 digits long.
+TEXT_HEADER = f"{'ID':<20} {'Level':>8} {'XP':>14}\n{'-' * 44}\n"
+
+
+def _text(rows: list[dict]) -> str:
+    return "".join(
+        f"{row['_id']:<20} {row['level']:>8} {row['xp']:>14}\n" for row in rows
+    )
+
+
+def _csv(rows: list[dict]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows((row["_id"], row["level"], row["xp"]) for row in rows)
+    return buffer.getvalue()
+
+
+def _jsonl(rows: list[dict]) -> str:
+    return "".join(
+        json.dumps({"id": row["_id"], "level": row["level"], "xp": row["xp"]}) + "\n"
+        for row in rows
+    )
+
+
+FORMATS: dict[str, tuple[str, str, Callable[[list[dict]], str]]] = {
+    "text": ("txt", TEXT_HEADER, _text),
+    "csv": ("csv", "id,level,xp\r\n", _csv),
+    "jsonl": ("jsonl", "", _jsonl),
+}
+
+
+async def _merge(
+    cursors: list[AsyncIOMotorCursor], key: Callable[[dict], Any]
+) -> AsyncIterator[dict]:
+    # Like heapq.merge, for cursors.
+    heap = []
+
+    for index, cursor in enumerate(cursors):
+        async for document in cursor:
+            heap.append((key(document), index, document))
+            break
+
+    heapq.heapify(heap)
+
+    while heap:
+        _, index, document = heap[0]
+        yield document
+
+        async for following in cursors[index]:
+            heapq.heapreplace(heap, (key(following), index, following))
+            break
+        else:
+            heapq.heappop(heap)
+
+
+async def export_levels(
+    cursors: list[AsyncIOMotorCursor],
+    format: str,
+    *,
+    transform: Callable[[dict], dict] | None = None,
+    key: Callable[[dict], Any] | None = None,
+    batch_size: int = 1000,
+    max_size: int = 1024 * 1024,
+) -> tempfile.SpooledTemporaryFile:
+
+    """
+    Streams level cursors into a file in the given format.
+
+    Several cursors that each yield their documents in ascending `key`
+    order are merged into one stream in that order. Documents are passed
+    through `transform`, if given, before being written. Only `batch_size`
+    documents per cursor are held at once, and the file stays in memory
+    until it grows past `max_size` bytes, after which it spills to disk. The
+    returned file is rewound and ready to be uploaded; the caller closes it.
+    """
+
+    _, header, formatter = FORMATS[format]
+    file = tempfile.SpooledTemporaryFile(max_size=max_size)
+    file.write(header.encode("utf-8"))
+
+    cursors = [cursor.batch_size(batch_size) for cursor in cursors]
+    documents = _merge(cursors, key) if len(cursors) > 1 else cursors[0]
+    batch = []
+
+    async for document in documents:
+        if transform is not None:
+            document = transform(document)
+
+        document.setdefault("level", 1)
+        document.setdefault("xp", 0)
+        batch.append(document)
+
+        if len(batch) >= batch_size:
+            file.write(formatter(batch).encode("utf-8"))
+            batch.clear()
+
+    if batch:
+        file.write(formatter(batch).encode("utf-8"))
+
+    file.seek(0)
+    return file
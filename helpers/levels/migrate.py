@@ -0,0 +1,104 @@
+import numpy as np
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import UpdateOne
+
+from helpers.levels.curve import LevelCurve
+
+
+def _totals(levels: np.ndarray, step: int) -> np.ndarray:
+    """LevelCurve.total for an array of levels."""
+    return step * (levels - 1) * (levels + 2) // 2
+
+
+def recompute_chunk(documents: list[dict], curve: LevelCurve) -> list[UpdateOne]:
+
+    """
+    Recomputes the total XP and level of a chunk of level documents at once.
+
+    Old documents are converted to the cumulative model and any document
+    whose stored level doesn't match its XP is corrected. Each update is
+    conditional on the values it was computed from, so a document the bot
+    has written to in the meantime is left alone rather than overwritten.
+    """
+
+    if not documents:
+        return []
+
+    ids = [document["_id"] for document in documents]
+    levels = np.array([document.get("level", 1) for document in documents], np.int64)
+    xps = np.array([document.get("xp", 0) for document in documents], np.float64)
+    current = np.array([document.get("v") == 2 for document in documents], np.bool_)
+
+    levels = np.maximum(levels, 1)
+    totals = np.where(current, xps, _totals(levels, curve.step) + xps)
+    totals = np.maximum(totals, 0).astype(np.int64)
+
+    # LevelCurve.level for the whole chunk. The float square root can be one
+    # off right at a threshold, so it is corrected against the exact totals.
+    new_levels = np.floor((np.sqrt(9 + 8 * totals / curve.step) - 1) / 2).astype(np.int64)
+    new_levels = np.maximum(new_levels, 1)
+    new_levels -= _totals(new_levels, curve.step) > totals
+    new_levels += _totals(new_levels + 1, curve.step) <= totals
+
+    changed = ~current | (new_levels != levels)
+    operations = []
+
+    for index in np.flatnonzero(changed):
+        document = documents[index]
+        expected = {
+            "_id": ids[index],
+            "v": 2 if current[index] else {"$exists": False},
+        }
+
+        if "level" in document:
+            expected["level"] = document["level"]
+        if "xp" in document:
+            expected["xp"] = document["xp"]
+
+        operations.append(
+            UpdateOne(
+                expected,
+                {
+                    "$set": {
+                        "xp": int(totals[index]),
+                        "level": int(new_levels[index]),
+                        "v": 2,
+                    }
+                },
+            )
+        )
+
+    return operations
+
+
+async def recompute_levels(
+    collection: AsyncIOMotorCollection, curve: LevelCurve, *, chunk_size: int = 5000
+) -> int:
+
+    """
+    Recomputes every level document in `collection` in chunks.
+
+    Returns how many documents were changed.
+    """
+
+    modified = 0
+    chunk = []
+    cursor = collection.find({}, {"level": 1, "xp": 1, "v": 1}).batch_size(chunk_size)
+
+    async for document in cursor:
+        chunk.append(document)
+
+        if len(chunk) >= chunk_size:
+            modified += await _write(collection, recompute_chunk(chunk, curve))
+            chunk.clear()
+
+    modified += await _write(collection, recompute_chunk(chunk, curve))
+    return modified
+
+
+async def _write(collection: AsyncIOMotorCollection, operations: list) -> int:
+    if not operations:
+        return 0
+
+    result = await collection.bulk_write(operations, ordered=False)
+    return result.modified_count
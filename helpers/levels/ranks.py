@@ -0,0 +1,179 @@
+import asyncio
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import AsyncIterable, Callable
+
+# A key packs (total XP, user ID) into one int, levels follow from the XP.
+MAX_XP = (1 << 63) - 1
+USER_BITS = 64
+USER_MASK = (1 << USER_BITS) - 1
+
+Loader = Callable[[int], AsyncIterable[tuple[int, int]]]
+
+
+def _key(user_id: int, xp: int) -> int:
+    # More XP gets a smaller key so the list is sorted best first, ties are
+    # broken by user ID.
+    return ((MAX_XP - min(max(int(xp), 0), MAX_XP)) << USER_BITS) | user_id
+
+
+def _unpack(key: int) -> tuple[int, int]:
+    return key & USER_MASK, MAX_XP - (key >> USER_BITS)
+
+
+class GuildRanks:
+
+    """
+    Every member of a guild ordered by total XP.
+
+    Each member is a single packed int in a sorted list, so positions and
+    neighbours are found with a binary search.
+    """
+
+    __slots__ = ("keys", "users")
+
+    def __init__(self, keys: list[int]) -> None:
+        keys.sort()
+        self.keys = keys
+        self.users: dict[int, int] = {key & USER_MASK: key for key in keys}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.users
+
+    def get(self, user_id: int) -> int | None:
+        key = self.users.get(user_id)
+        return None if key is None else _unpack(key)[1]
+
+    def set(self, user_id: int, xp: int) -> None:
+        self.remove(user_id)
+
+        key = _key(user_id, xp)
+        insort(self.keys, key)
+        self.users[user_id] = key
+
+    def remove(self, user_id: int) -> None:
+        key = self.users.pop(user_id, None)
+
+        if key is not None:
+            del self.keys[bisect_left(self.keys, key)]
+
+    def position(self, user_id: int) -> int | None:
+        """The 1-based rank of a user, or None if they have no XP."""
+
+        key = self.users.get(user_id)
+        return None if key is None else bisect_left(self.keys, key) + 1
+
+    def top(self, amount: int, start: int = 0) -> list[tuple[int, int]]:
+        """(user ID, total XP) of `amount` members starting at index `start`."""
+
+        return [_unpack(key) for key in self.keys[start : start + amount]]
+
+    def neighbours(self, user_id: int, amount: int = 1) -> list[tuple[int, int]]:
+        """The user with up to `amount` members ranked above and below them."""
+
+        position = self.position(user_id)
+
+        if position is None:
+            return []
+
+        start = max(position - 1 - amount, 0)
+        return self.top(position - start + amount, start)
+
+
+class RankIndex:
+
+    """
+    Lazily built `GuildRanks` for every guild that asks for them.
+
+    A guild is loaded through `loader`, which yields (user ID, total XP)
+    pairs, the first time it is needed and then kept up to date by the
+    caller. Once the indexes hold more than `max_entries` members in total,
+    the least recently used guilds are dropped and will be loaded again on
+    their next use.
+
+    Usage:
+    ```py
+    >>> ranks = RankIndex(load_guild)
+    >>> (await ranks.get(guild_id)).position(user_id)
+    1
+    ```
+    """
+
+    def __init__(self, loader: Loader, *, max_entries: int = 500_000) -> None:
+        self.loader = loader
+        self.max_entries = max_entries
+
+        self._guilds: OrderedDict[int, GuildRanks] = OrderedDict()
+        self._loading: dict[int, asyncio.Task] = {}
+        self.entries: int = 0
+
+        self.loads: int = 0
+        self.evictions: int = 0
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "guilds": len(self._guilds),
+            "entries": self.entries,
+            "max_entries": self.max_entries,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+    def peek(self, guild_id: int) -> GuildRanks | None:
+        """The guild's index if it is already loaded, without marking it as used."""
+        return self._guilds.get(guild_id)
+
+    async def _load(self, guild_id: int) -> GuildRanks:
+        keys = [_key(user_id, xp) async for user_id, xp in self.loader(guild_id)]
+        return GuildRanks(keys)
+
+    async def get(self, guild_id: int) -> GuildRanks:
+        ranks = self._guilds.get(guild_id)
+
+        if ranks is not None:
+            self._guilds.move_to_end(guild_id)
+            return ranks
+
+        # Concurrent callers share a single load.
+        task = self._loading.get(guild_id)
+        if task is None:
+            task = self._loading[guild_id] = asyncio.create_task(self._load(guild_id))
+
+        try:
+            ranks = await asyncio.shield(task)
+        finally:
+            self._loading.pop(guild_id, None)
+
+        if guild_id not in self._guilds:
+            self._guilds[guild_id] = ranks
+            self.entries += len(ranks)
+            self.loads += 1
+            self._evict()
+
+        return self._guilds[guild_id]
+
+    def update(self, guild_id: int, user_id: int, xp: int) -> None:
+        ranks = self._guilds.get(guild_id)
+
+        if ranks is None:
+            return
+
+        self.entries -= len(ranks)
+        ranks.set(user_id, xp)
+        self.entries += len(ranks)
+
+    def invalidate(self, guild_id: int) -> None:
+        ranks = self._guilds.pop(guild_id, None)
+
+        if ranks is not None:
+            self.entries -= len(ranks)
+
+    def _evict(self) -> None:
+        while self.entries > self.max_entries and len(self._guilds) > 1:
+            _, ranks = self._guilds.popitem(last=False)
+            self.entries -= len(ranks)
+            self.evictions += 1
@@ -0,0 +1,352 @@
+import asyncio
+import functools
+import hashlib
+import io
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
+
+from easy_pil import Canvas, Editor, Font
+from PIL import Image, ImageDraw, ImageFont
+
+# Static layers are built once per worker process and copied for each render.
+_TEMPLATES: OrderedDict[tuple, tuple[Image.Image, bool]] = OrderedDict()
+MAX_TEMPLATES = 16
+
+# Anchors matching Editor.text's alignments.
+ANCHORS = {"left": "lt", "center": "mt", "right": "rt"}
+
+# zlib's fastest level is several times quicker than the default of 6 and the
+# flat card colours still compress well.
+COMPRESS_LEVEL = 1
+
+
+class RenderError(Exception):
+    """Raised when an image could not be rendered in time."""
+
+
+class RenderPoolFull(RenderError):
+    """Raised when too many renders are already queued."""
+
+
+class RenderTimeout(RenderError):
+    """Raised when a render takes longer than the pool's timeout."""
+
+
+def pack(image: Image.Image) -> tuple[str, tuple[int, int], bytes]:
+    """Turns a decoded image into raw pixels that are cheap to send to a worker."""
+    return image.mode, image.size, image.tobytes()
+
+
+def _open(data: bytes | tuple) -> Image.Image:
+    if isinstance(data, tuple):
+        return Image.frombytes(*data)
+
+    return Image.open(io.BytesIO(data))
+
+
+def _encode(editor: Editor, opaque: bool = False) -> bytes:
+    # Dropping an alpha channel nobody can see saves a quarter of the work.
+    image = editor.image.convert("RGB") if opaque else editor.image
+
+    with io.BytesIO() as buffer:
+        image.save(buffer, "PNG", compress_level=COMPRESS_LEVEL)
+        return buffer.getvalue()
+
+
+def _paste(editor: Editor, image: Editor, position: tuple[int, int]) -> None:
+    # Editor.paste composites a full-size blank layer, this only touches the
+    # area the image covers.
+    editor.image.alpha_composite(image.image, dest=position)
+
+
+@functools.lru_cache(maxsize=None)
+def _font(size: int) -> ImageFont.FreeTypeFont:
+    return Font.poppins(size=size)
+
+
+@functools.lru_cache(maxsize=1024)
+def _glyphs(text: str, size: int, anchor: str) -> tuple[Image.Image, tuple[int, int]]:
+    # Names, ranks and member counts repeat from one card to the next, so the
+    # rendered text is kept instead of being laid out by FreeType each time.
+    font = _font(size)
+    left, top, right, bottom = font.getbbox(text, anchor=anchor)
+    mask = Image.new("L", (right - left, bottom - top))
+    ImageDraw.Draw(mask).text((-left, -top), text, fill=255, font=font, anchor=anchor)
+    return mask, (left, top)
+
+
+def _text(
+    editor: Editor, position: tuple[int, int], text: str, size: int, color: str, align: str = "left"
+) -> None:
+    # The same pixels as Editor.text, which fills the glyph mask with the colour.
+    mask, (left, top) = _glyphs(text, size, ANCHORS[align])
+    editor.image.paste(color, (position[0] + left, position[1] + top), mask)
+
+
+def _template(key: tuple, build: Callable[[], Editor]) -> tuple[Editor, bool]:
+    cached = _TEMPLATES.get(key)
+
+    if cached is None:
+        base = build().image
+        cached = _TEMPLATES[key] = (base, base.getextrema()[3][0] == 255)
+
+        if len(_TEMPLATES) > MAX_TEMPLATES:
+            _TEMPLATES.popitem(last=False)
+    else:
+        _TEMPLATES.move_to_end(key)
+
+    base, opaque = cached
+
+    # Editor converts to RGBA, which hands us a copy of the cached base.
+    return Editor(base), opaque
+
+
+def _rank_card_base(background: bytes | None) -> Editor:
+    if background:
+        base = Editor(_open(background)).resize((800, 280))
+    else:
+        base = Editor(Canvas((800, 280), color="#23272A"))
+
+    card_right_shape = [(600, 0), (750, 300), (900, 300), (900, 0)]
+
+    base.polygon(card_right_shape, "#2C2F33")
+    base.rectangle((30, 200), width=650, height=40, fill="#494b4f", radius=20)
+    base.rectangle((200, 100), width=350, height=2, fill="#17F3F6")
+
+    return base
+
+
+def _leaderboard_base() -> Editor:
+    return Editor(Canvas((1400, 1280), color="#23272A"))
+
+
+def render_rank_card(card: dict) -> bytes:
+
+    """
+    Draws a rank card and returns it as PNG bytes.
+
+    `card` only holds plain data so it can be sent to a worker process:
+    name, level, xp, next_level_xp, percentage, rank and members (or None),
+    avatar (packed pixels or image bytes) and background (image bytes or None).
+    """
+
+    background = card["background"]
+    key = ("rank_card", hashlib.sha1(background).digest() if background else None)
+    image, opaque = _template(key, lambda: _rank_card_base(background))
+
+    profile = Editor(_open(card["avatar"])).resize((150, 150)).circle_image()
+
+    _paste(image, profile, (30, 30))
+    image.bar(
+        (30, 200),
+        max_width=650,
+        height=40,
+        percentage=card["percentage"],
+        fill="#3db374",
+        radius=20,
+    )
+    _text(image, (200, 40), card["name"], 40, "white")
+    _text(
+        image,
+        (200, 130),
+        f"Level: {card['level']} " + f" XP: {card['xp']: ,} / {card['next_level_xp']: ,}",
+        30,
+        "white",
+    )
+
+    if card["rank"] is not None:
+        _text(image, (770, 30), f"#{card['rank']:,}", 40, "white", align="right")
+        _text(image, (770, 80), f"of {card['members']:,}", 30, "#b9bbbe", align="right")
+
+    return _encode(image, opaque)
+
+
+def render_leaderboard(rows: list[dict]) -> bytes:
+
+    """
+    Draws the leaderboard image and returns it as PNG bytes.
+
+    Each row holds a name, a level and an avatar (packed pixels or image bytes).
+    """
+
+    background, opaque = _template(("leaderboard",), _leaderboard_base)
+    paste_size = 0
+    text_size = 40
+
+    for row in rows:
+        avatar = Editor(_open(row["avatar"])).resize((128, 128))
+
+        _text(background, (175, text_size), f'{row["name"]} • Level{row["level"]: ,}', 50, "white")
+        _paste(background, avatar, (0, paste_size))
+        paste_size += 128
+        text_size += 130
+
+    return _encode(background, opaque)
+
+
+def _original_rank_card(card: dict) -> bytes:
+    # The drawing and encoding the rank command did before the render
+    # workers, with the avatar already downloaded.
+    background = Editor(Canvas((800, 280), color="#23272A"))
+    profile = Editor(_open(card["avatar"])).resize((150, 150)).circle_image()
+
+    poppins = Font.poppins(size=40)
+    poppins_small = Font.poppins(size=30)
+
+    card_right_shape = [(600, 0), (750, 300), (900, 300), (900, 0)]
+
+    background.polygon(card_right_shape, "#2C2F33")
+    background.paste(profile, (30, 30))
+
+    background.rectangle((30, 200), width=650, height=40, fill="#494b4f", radius=20)
+    background.bar(
+        (30, 200),
+        max_width=650,
+        height=40,
+        percentage=card["percentage"],
+        fill="#3db374",
+        radius=20,
+    )
+    background.text((200, 40), card["name"], font=poppins, color="white")
+
+    background.rectangle((200, 100), width=350, height=2, fill="#17F3F6")
+    background.text(
+        (200, 130),
+        f"Level: {card['level']} "
+        + f" XP: {card['xp']: ,} / {card['next_level_xp']: ,}",
+        font=poppins_small,
+        color="white",
+    )
+
+    with io.BytesIO() as buffer:
+        background.save(buffer, "PNG")
+        return buffer.getvalue()
+
+
+def _original_leaderboard(rows: list[dict]) -> bytes:
+    # Likewise for the leaderboard command, with the avatars already downloaded.
+    background = Editor(Canvas((1400, 1280), color="#23272A"))
+    paste_size = 0
+    text_size = 40
+
+    for row in rows:
+        img = Editor(_open(row["avatar"])).resize((128, 128))
+
+        background.text(
+            (175, text_size),
+            f'{row["name"]} • Level{row["level"]: ,}',
+            color="white",
+            font=Font.poppins(size=50),
+        )
+
+        background.paste(img, (0, paste_size))
+        paste_size += 128
+        text_size += 130
+
+    with io.BytesIO() as buffer:
+        background.save(buffer, "PNG")
+        return buffer.getvalue()
+
+
+def benchmark(runs: int = 50) -> None:
+
+    """
+    Times rank card and leaderboard renders against the drawing code they replaced.
+
+    The originals are kept above as they were, minus the downloads, which
+    both sides would pay for equally. The new rank card also draws the rank.
+    Each rank card has different XP, so its XP line is never a cached one.
+    """
+
+    avatar = pack(Image.new("RGBA", (150, 150), "#5865F2"))
+    card = {
+        "name": "Bonbons#0001",
+        "xp": 1234,
+        "next_level_xp": 2500,
+        "level": 19,
+        "percentage": 49,
+        "rank": 3,
+        "members": 1024,
+        "avatar": avatar,
+        "background": None,
+    }
+    rows = [
+        {"name": f"User#{index:04}", "level": 20 - index, "avatar": avatar}
+        for index in range(10)
+    ]
+
+    cards = [{**card, "xp": card["xp"] + run} for run in range(runs + 1)]
+
+    for name, original, current, args in (
+        ("rank card", _original_rank_card, render_rank_card, cards),
+        ("leaderboard", _original_leaderboard, render_leaderboard, [rows] * (runs + 1)),
+    ):
+        timings = {}
+
+        for mode, func in (("original", original), ("current", current)):
+            func(args[0])
+            before = time.perf_counter()
+
+            for run in range(1, runs + 1):
+                func(args[run])
+
+            timings[mode] = (time.perf_counter() - before) / runs * 1000
+
+        print(
+            f"{name}: original {timings['original']:.2f}ms, "
+            + f"current {timings['current']:.2f}ms "
+            + f"({timings['original'] / timings['current']:.1f}x faster)"
+        )
+
+
+class RenderPool:
+
+    """
+    Runs image renders in worker processes so they never block the event loop.
+
+    At most `max_pending` renders may be queued or running at once; further
+    requests raise `RenderPoolFull` straight away instead of waiting. A render
+    that takes longer than `timeout` seconds raises `RenderTimeout`.
+    """
+
+    def __init__(
+        self, *, workers: int = 2, max_pending: int = 8, timeout: float = 10
+    ) -> None:
+        # Forking would copy a process already running motor's and aiohttp's
+        # threads, which can deadlock the worker. Renders only take plain data.
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("forkserver")
+        )
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending: int = 0
+
+    def _release(self, _) -> None:
+        self.pending -= 1
+
+    async def render(self, func: Callable[..., bytes], *args: Any) -> bytes:
+        if self.pending >= self.max_pending:
+            raise RenderPoolFull("Too many images are being rendered right now.")
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, func, *args)
+
+        # The slot is only freed once the worker is actually done, even if the
+        # caller stopped waiting for it.
+        self.pending += 1
+        future.add_done_callback(self._release)
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise RenderTimeout("Rendering the image took too long.") from None
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,3 +1,6 @@
+import math
+from typing import Awaitable, Callable
+
 import discord
 from discord.ext import commands
 
@@ -65,6 +68,59 @@ class Paginator(discord.ui.View):
         await self.show_page(inter, self.current_page - self.current_page - 1)
 
 
+class KeysetPaginator(Paginator):
+
+    """
+    A `Paginator` that only fetches a page when it is shown.
+
+    `fetch` is called with `after` (the last item of the previous page),
+    `before` (the first item of the next page) or `skip` for a page that
+    is reached by jumping, and returns the page's items in order. `format`
+    turns a page of items into the message content.
+    """
+
+    def __init__(
+        self,
+        ctx: commands.Context,
+        fetch: Callable[..., Awaitable[list]],
+        format: Callable[[list, int, int], str],
+        *,
+        total: int,
+        per_page: int,
+        timeout: int = 120,
+    ):
+        super().__init__(ctx, [], timeout=timeout)
+        self.fetch = fetch
+        self.format = format
+        self.per_page = per_page
+        self.pages = max(math.ceil(total / per_page), 1)
+        self.fetched: dict[int, list] = {}
+
+    async def get_page(self, page: int) -> str:
+        items = self.fetched.get(page)
+
+        if items is None:
+            if page - 1 in self.fetched and self.fetched[page - 1]:
+                items = await self.fetch(after=self.fetched[page - 1][-1])
+            elif page + 1 in self.fetched and self.fetched[page + 1]:
+                items = await self.fetch(before=self.fetched[page + 1][0])
+            else:
+                items = await self.fetch(skip=page * self.per_page)
+
+            self.fetched[page] = items
+
+        return self.format(items, page, self.pages)
+
+    async def show_page(self, inter, page: int):
+        if page >= self.pages:
+            page = 0
+        elif page < 0:
+            page = self.pages - 1
+
+        self.current_page = page
+        await inter.edit_original_message(content=await self.get_page(page), view=self)
+
+
 class HelpMenuPaginator(discord.ui.View):
     def __init__(
         self,
@@ -0,0 +1,119 @@
+import os
+import pickle
+
+
+class InventoryCache:
+
+    """
+    Parsed Sphinx inventories, kept on disk between restarts.
+
+    Each project's inventory is stored with the URL it came from and the
+    `ETag` and `Last-Modified` headers it was served with, so it can be
+    refreshed with a conditional request that only downloads and parses
+    `objects.inv` again when it has changed. The file is a pickle, written
+    by the bot itself, which loads far faster than parsing the inventories.
+
+    Usage:
+    ```py
+    >>> inventories = InventoryCache(".cache/rtfm.pickle")
+    >>> inventories.load()
+    >>> inventories.headers("python", "https://docs.python.org/3")
+    {'If-None-Match': '"64f1c2a8-1a2b3"'}
+    >>> inventories["python"]["str.join"]
+    'https://docs.python.org/3/library/stdtypes.html#str.join'
+    ```
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str = ".cache/rtfm.pickle") -> None:
+        self.path = path
+
+        # project: inventory, and project: (URL, ETag, Last-Modified).
+        self._inventories: dict[str, dict[str, str]] = {}
+        self._validators: dict[str, tuple[str, str | None, str | None]] = {}
+
+        self.downloads: int = 0
+        self.not_modified: int = 0
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "projects": len(self._inventories),
+            "entries": sum(map(len, self._inventories.values())),
+            "downloads": self.downloads,
+            "not_modified": self.not_modified,
+        }
+
+    def __contains__(self, project: str) -> bool:
+        return project in self._inventories
+
+    def __getitem__(self, project: str) -> dict[str, str]:
+        return self._inventories[project]
+
+    def load(self) -> None:
+        """Reads the cache file, if there is a usable one. Blocks, run it in a thread."""
+
+        try:
+            with open(self.path, "rb") as file:
+                version, inventories, validators = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+            return
+
+        # Written by an older version that parsed inventories differently.
+        if version != self.VERSION:
+            return
+
+        self._inventories.update(inventories)
+        self._validators.update(validators)
+
+    def save(self) -> None:
+        """Writes the cache file. Blocks, run it in a thread."""
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temporary = f"{self.path}.tmp"
+
+        with open(temporary, "wb") as file:
+            pickle.dump(
+                (self.VERSION, self._inventories, self._validators),
+                file,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+
+        # A crash mid-write leaves the old file rather than half of a new one.
+        os.replace(temporary, self.path)
+
+    def headers(self, project: str, url: str) -> dict[str, str]:
+        """The headers that make fetching `url` conditional on it having changed."""
+
+        validators = self._validators.get(project)
+
+        # The project moved to another URL, so the old validators mean nothing.
+        if validators is None or validators[0] != url or project not in self._inventories:
+            return {}
+
+        _, etag, last_modified = validators
+        headers = {}
+
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        if last_modified is not None:
+            headers["If-Modified-Since"] = last_modified
+
+        return headers
+
+    def unchanged(self) -> None:
+        self.not_modified += 1
+
+    def set(
+        self,
+        project: str,
+        url: str,
+        inventory: dict[str, str],
+        *,
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ) -> None:
+        self._inventories[project] = inventory
+        self._validators[project] = (url, etag, last_modified)
+        self.downloads += 1
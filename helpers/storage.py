@@ -0,0 +1,424 @@
+import asyncio
+import contextlib
+from typing import Any, AsyncContextManager, Callable
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+
+from helpers.indexes import IndexManager
+
+# Every feature database keeps its shared collection under this name, next to
+# the old per-guild collections which are named after the guild ID.
+SHARED = "shared"
+
+Hold = Callable[[int], AsyncContextManager[None]]
+
+
+def _rename(filter: dict) -> dict:
+    renamed = {}
+
+    for key, value in filter.items():
+        if key in ("$and", "$or", "$nor"):
+            value = [_rename(clause) for clause in value]
+
+        renamed["key" if key == "_id" else key] = value
+
+    return renamed
+
+
+def _projection(projection: dict | list | None) -> dict:
+    if not projection:
+        return {"_id": 0}
+
+    if not isinstance(projection, dict):
+        projection = dict.fromkeys(projection, 1)
+
+    renamed = {key: value for key, value in projection.items() if key != "_id"}
+    including = any(renamed.values())
+    key = projection.get("_id", True)
+
+    # Excluding `key` can't be mixed with including other fields, leaving it
+    # out does the same there.
+    if key and (including or not renamed):
+        renamed["key"] = 1
+    elif not key and not including:
+        renamed["key"] = 0
+
+    renamed["_id"] = 0
+    return renamed
+
+
+def _sort(key: Any, direction: int | None = None) -> Any:
+    if isinstance(key, str):
+        key = "key" if key == "_id" else key
+        return key if direction is None else [(key, direction)]
+
+    return [("key" if name == "_id" else name, order) for name, order in key]
+
+
+def _unwrap(document: dict | None) -> dict | None:
+    if document is None:
+        return None
+
+    document.pop("guild_id", None)
+
+    if "key" not in document:
+        return document
+
+    return {"_id": document.pop("key"), **document}
+
+
+class GuildCursor:
+
+    """A cursor over a `GuildCollection` that hands back per-guild documents."""
+
+    __slots__ = ("cursor",)
+
+    def __init__(self, cursor) -> None:
+        self.cursor = cursor
+
+    def sort(self, key: Any, direction: int | None = None) -> "GuildCursor":
+        self.cursor.sort(_sort(key, direction))
+        return self
+
+    def batch_size(self, batch_size: int) -> "GuildCursor":
+        self.cursor.batch_size(batch_size)
+        return self
+
+    def limit(self, limit: int) -> "GuildCursor":
+        self.cursor.limit(limit)
+        return self
+
+    def skip(self, skip: int) -> "GuildCursor":
+        self.cursor.skip(skip)
+        return self
+
+    def __aiter__(self) -> "GuildCursor":
+        return self
+
+    async def __anext__(self) -> dict:
+        return _unwrap(await self.cursor.next())
+
+    async def to_list(self, length: int | None) -> list[dict]:
+        return [_unwrap(document) for document in await self.cursor.to_list(length)]
+
+
+class GuildCollection:
+
+    """
+    One guild's slice of a shared collection.
+
+    Behaves like the guild's old collection: filters, projections, sorts and
+    documents use `_id` as before, which is stored as `key` next to a
+    `guild_id` field, and every query is scoped to the guild.
+    """
+
+    __slots__ = ("collection", "guild_id")
+
+    def __init__(self, collection: AsyncIOMotorCollection, guild_id: int) -> None:
+        self.collection = collection
+        self.guild_id = guild_id
+
+    def _filter(self, filter: Any) -> dict:
+        if filter is None:
+            filter = {}
+        elif not isinstance(filter, dict):
+            filter = {"_id": filter}
+
+        return {**_rename(filter), "guild_id": self.guild_id}
+
+    def _document(self, document: dict, key: Any = None) -> dict:
+        wrapped = {name: value for name, value in document.items() if name != "_id"}
+        wrapped["guild_id"] = self.guild_id
+        wrapped["key"] = document.get("_id", ObjectId() if key is None else key)
+        return wrapped
+
+    def _request(self, request: Any) -> Any:
+        # pymongo's write models don't expose their arguments, so they are
+        # rebuilt from their attributes.
+        if isinstance(request, InsertOne):
+            return InsertOne(self._document(request._doc))
+
+        if isinstance(request, (UpdateOne, UpdateMany)):
+            return type(request)(
+                self._filter(request._filter),
+                request._doc,
+                upsert=request._upsert,
+                collation=request._collation,
+                array_filters=request._array_filters,
+                hint=request._hint,
+            )
+
+        if isinstance(request, ReplaceOne):
+            return ReplaceOne(
+                self._filter(request._filter),
+                self._document(request._doc, request._filter.get("_id")),
+                upsert=request._upsert,
+                collation=request._collation,
+                hint=request._hint,
+            )
+
+        if isinstance(request, (DeleteOne, DeleteMany)):
+            return type(request)(
+                self._filter(request._filter),
+                collation=request._collation,
+                hint=request._hint,
+            )
+
+        raise TypeError(f"Unsupported write: {request!r}")
+
+    def find(self, filter: Any = None, projection: Any = None, **kwargs) -> GuildCursor:
+        if "sort" in kwargs:
+            kwargs["sort"] = _sort(kwargs["sort"])
+
+        return GuildCursor(
+            self.collection.find(self._filter(filter), _projection(projection), **kwargs)
+        )
+
+    async def find_one(self, filter: Any = None, projection: Any = None, **kwargs) -> dict | None:
+        if "sort" in kwargs:
+            kwargs["sort"] = _sort(kwargs["sort"])
+
+        return _unwrap(
+            await self.collection.find_one(
+                self._filter(filter), _projection(projection), **kwargs
+            )
+        )
+
+    async def count_documents(self, filter: Any = None, **kwargs) -> int:
+        return await self.collection.count_documents(self._filter(filter), **kwargs)
+
+    async def insert_one(self, document: dict, **kwargs):
+        return await self.collection.insert_one(self._document(document), **kwargs)
+
+    async def insert_many(self, documents: list[dict], **kwargs):
+        return await self.collection.insert_many(
+            [self._document(document) for document in documents], **kwargs
+        )
+
+    async def update_one(self, filter: Any, update: Any, **kwargs):
+        return await self.collection.update_one(self._filter(filter), update, **kwargs)
+
+    async def update_many(self, filter: Any, update: Any, **kwargs):
+        return await self.collection.update_many(self._filter(filter), update, **kwargs)
+
+    async def replace_one(self, filter: Any, replacement: dict, **kwargs):
+        return await self.collection.replace_one(
+            self._filter(filter),
+            self._document(replacement, (filter or {}).get("_id")),
+            **kwargs,
+        )
+
+    async def delete_one(self, filter: Any, **kwargs):
+        return await self.collection.delete_one(self._filter(filter), **kwargs)
+
+    async def delete_many(self, filter: Any, **kwargs):
+        return await self.collection.delete_many(self._filter(filter), **kwargs)
+
+    async def bulk_write(self, requests: list, **kwargs):
+        return await self.collection.bulk_write(
+            [self._request(request) for request in requests], **kwargs
+        )
+
+
+class Storage:
+
+    """
+    Decides where each guild's data for a feature lives.
+
+    Guilds that still have an old per-guild collection keep using it until
+    they are migrated, everything else goes to the feature's shared
+    collection, unless `mode` is "guild", in which case new guilds get a
+    collection of their own as before.
+
+    Usage:
+    ```py
+    >>> storage = Storage(bot.mongo, bot.indexes)
+    >>> await storage.load(("levels", "tags"))
+    >>> await storage.collection("levels", guild.id).find_one({"_id": user.id})
+    >>> await storage.migrate_all("levels")
+    ```
+    """
+
+    def __init__(
+        self,
+        client: AsyncIOMotorClient,
+        indexes: IndexManager,
+        *,
+        mode: str = "shared",
+        database: str = "bonbons",
+    ) -> None:
+        self.client = client
+        self.indexes = indexes
+        self.mode = mode
+        self.migrations = client[database]["migrations"]
+
+        # Called with a guild ID around the switch-over of a guild, features
+        # that buffer writes use it to flush and pause them.
+        self.holds: dict[str, Hold] = {}
+
+        self._legacy: dict[str, set[int]] = {}
+        self._migrated: dict[str, set[int]] = {}
+        self._lock = asyncio.Lock()
+
+    async def load(self, features: tuple[str, ...]) -> None:
+        """Reads which guilds have their own collections and which were migrated."""
+
+        for feature in features:
+            names = await self.client[feature].list_collection_names()
+            self._legacy[feature] = {int(name) for name in names if name.isdigit()}
+            self._migrated[feature] = set()
+
+        async for state in self.migrations.find({"done": True}, {"_id": 1}):
+            feature, guild_id = state["_id"].split(":")
+            self._migrated.setdefault(feature, set()).add(int(guild_id))
+
+    def shared(self, feature: str) -> AsyncIOMotorCollection:
+        collection = self.client[feature][SHARED]
+        self.indexes.ensure(collection)
+        return collection
+
+    def is_shared(self, feature: str, guild_id: int) -> bool:
+        if guild_id in self._migrated.setdefault(feature, set()):
+            return True
+
+        legacy = self._legacy.setdefault(feature, set())
+
+        if guild_id in legacy:
+            return False
+
+        if self.mode == "guild":
+            legacy.add(guild_id)
+            return False
+
+        return True
+
+    def collection(self, feature: str, guild_id: int) -> AsyncIOMotorCollection | GuildCollection:
+        if self.is_shared(feature, guild_id):
+            return GuildCollection(self.shared(feature), guild_id)
+
+        collection = self.client[feature][str(guild_id)]
+        self.indexes.ensure(collection)
+        return collection
+
+    @property
+    def pending(self) -> dict[str, int]:
+        """How many guilds of each feature still have to be migrated."""
+
+        return {
+            feature: len(guilds - self._migrated.get(feature, set()))
+            for feature, guilds in self._legacy.items()
+        }
+
+    async def migrate_all(self, feature: str, *, batch_size: int = 1000) -> tuple[int, int]:
+        """
+        Migrates every guild of a feature that still has its own collection.
+
+        Returns how many guilds and documents were migrated. Safe to run
+        again after an interruption, it picks up where it stopped.
+        """
+
+        guilds = documents = 0
+
+        async with self._lock:
+            for guild_id in sorted(self._legacy.get(feature, set())):
+                if guild_id in self._migrated.get(feature, set()):
+                    continue
+
+                documents += await self.migrate(feature, guild_id, batch_size=batch_size)
+                guilds += 1
+
+        return guilds, documents
+
+    async def migrate(self, feature: str, guild_id: int, *, batch_size: int = 1000) -> int:
+
+        """
+        Copies a guild's collection into the shared collection and switches
+        the guild over to it.
+
+        The bulk of the copy happens while the guild is still in use and its
+        progress is saved after every batch. Once it is done, the guild is
+        held, brought up to date with whatever changed in the meantime, and
+        switched over. The old collection is left in place.
+        """
+
+        state_id = f"{feature}:{guild_id}"
+        state = await self.migrations.find_one({"_id": state_id}) or {}
+
+        if state.get("done"):
+            self._migrated.setdefault(feature, set()).add(guild_id)
+            return 0
+
+        source = self.client[feature][str(guild_id)]
+        target = GuildCollection(self.shared(feature), guild_id)
+        copied = await self._copy(source, target, state_id, state.get("last"), batch_size)
+
+        hold = self.holds.get(feature)
+
+        async with hold(guild_id) if hold is not None else contextlib.nullcontext():
+            await self._sync(source, target, batch_size)
+            await self.migrations.update_one(
+                {"_id": state_id}, {"$set": {"done": True}}, upsert=True
+            )
+            self._migrated.setdefault(feature, set()).add(guild_id)
+
+        return copied
+
+    async def _copy(
+        self,
+        source: AsyncIOMotorCollection,
+        target: GuildCollection,
+        state_id: str,
+        last: Any,
+        batch_size: int,
+    ) -> int:
+        copied = 0
+        filter = {} if last is None else {"_id": {"$gt": last}}
+        cursor = source.find(filter).sort("_id", 1).batch_size(batch_size)
+
+        while batch := await cursor.to_list(batch_size):
+            await target.bulk_write(
+                [ReplaceOne({"_id": document["_id"]}, document, upsert=True) for document in batch],
+                ordered=False,
+            )
+            await self.migrations.update_one(
+                {"_id": state_id}, {"$set": {"last": batch[-1]["_id"]}}, upsert=True
+            )
+            copied += len(batch)
+
+        return copied
+
+    async def _sync(
+        self, source: AsyncIOMotorCollection, target: GuildCollection, batch_size: int
+    ) -> None:
+        # Only documents that differ are written, so this is mostly reads.
+        seen = set()
+        cursor = source.find({}).sort("_id", 1).batch_size(batch_size)
+
+        while batch := await cursor.to_list(batch_size):
+            keys = [document["_id"] for document in batch]
+            seen.update(keys)
+
+            copies = {
+                document["_id"]: document
+                async for document in target.find({"_id": {"$in": keys}})
+            }
+            requests = [
+                ReplaceOne({"_id": document["_id"]}, document, upsert=True)
+                for document in batch
+                if copies.get(document["_id"]) != document
+            ]
+
+            if requests:
+                await target.bulk_write(requests, ordered=False)
+
+        # Documents deleted from the old collection since they were copied.
+        removed = [
+            document["_id"]
+            async for document in target.find({}, {"_id": 1})
+            if document["_id"] not in seen
+        ]
+
+        for index in range(0, len(removed), batch_size):
+            await target.delete_many({"_id": {"$in": removed[index : index + batch_size]}})
@@ -0,0 +1,121 @@
+import time
+from collections import OrderedDict
+
+
+class TagCache:
+
+    """
+    Recently used tag documents, found by name or by ID.
+
+    Holds at most `max_entries` tags across all guilds and drops the least
+    recently used first. The tag commands keep it current as tags change,
+    and every entry also expires after `ttl` seconds in case a tag was
+    changed some other way.
+
+    Usage:
+    ```py
+    >>> cache = TagCache(max_entries=2048, ttl=300)
+    >>> cache.set(guild_id, tag)
+    >>> cache.get(guild_id, "hello")
+    {'_id': 1, 'name': 'hello', ...}
+    ```
+    """
+
+    def __init__(self, *, max_entries: int = 2048, ttl: float = 300) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        # (guild ID, tag ID): (expiry, tag), and (guild ID, name): tag ID.
+        self._tags: OrderedDict[tuple[int, int], tuple[float, dict]] = OrderedDict()
+        self._names: dict[tuple[int, str], int] = {}
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    @property
+    def stats(self) -> dict[str, int | float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._tags),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def get(self, guild_id: int, name: str, *, tag_id: int | None = None) -> dict | None:
+        """
+        A tag by its name or, failing that, by `tag_id`, as one lookup.
+
+        Names are kept in any case, but a tag whose name only matches in
+        another case is a miss. Another tag may match exactly, and it has to
+        win, so the caller must ask the database. Likewise, only pass
+        `tag_id` once no tag can be named `name`, which the cache can't tell.
+        """
+
+        named = self._names.get((guild_id, name.casefold()))
+        tag = self._get(guild_id, named) if named is not None else None
+
+        if tag is not None and tag["name"] != name:
+            return self._count(None)
+
+        if tag is None and tag_id is not None:
+            tag = self._get(guild_id, tag_id)
+
+        return self._count(tag)
+
+    def get_id(self, guild_id: int, tag_id: int) -> dict | None:
+        return self._count(self._get(guild_id, tag_id))
+
+    def peek(self, guild_id: int, tag_id: int) -> dict | None:
+        """A cached tag, without counting a lookup or marking it as used."""
+
+        entry = self._tags.get((guild_id, tag_id))
+        return entry[1] if entry is not None else None
+
+    def _get(self, guild_id: int, tag_id: int) -> dict | None:
+        entry = self._tags.get((guild_id, tag_id))
+
+        if entry is None:
+            return None
+
+        expiry, tag = entry
+
+        if expiry < time.monotonic():
+            self.invalidate(guild_id, tag_id)
+            return None
+
+        self._tags.move_to_end((guild_id, tag_id))
+        return tag
+
+    def _count(self, tag: dict | None) -> dict | None:
+        if tag is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return tag
+
+    def set(self, guild_id: int, tag: dict) -> None:
+        # A renamed tag must not stay reachable by its old name.
+        self.invalidate(guild_id, tag["_id"])
+
+        self._tags[(guild_id, tag["_id"])] = (time.monotonic() + self.ttl, tag)
+        self._names[(guild_id, tag["name"].casefold())] = tag["_id"]
+
+        while len(self._tags) > self.max_entries:
+            (evicted_guild, _), (_, evicted) = self._tags.popitem(last=False)
+            self._names.pop((evicted_guild, evicted["name"].casefold()), None)
+            self.evictions += 1
+
+    def invalidate(self, guild_id: int, tag_id: int) -> None:
+        entry = self._tags.pop((guild_id, tag_id), None)
+
+        if entry is not None:
+            self._names.pop((guild_id, entry[1]["name"].casefold()), None)
+
+    def invalidate_guild(self, guild_id: int) -> None:
+        for key in [key for key in self._tags if key[0] == guild_id]:
+            self.invalidate(*key)
@@ -0,0 +1,55 @@
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ReturnDocument
+
+
+class IDAllocator:
+
+    """
+    Hands out tag IDs from a per-guild counter.
+
+    Each ID is a single atomic `$inc` on the guild's counter document, so
+    concurrent creations never share an ID and the cost doesn't depend on
+    how many tags a guild has. A guild without a counter yet has it seeded
+    from its highest existing ID first.
+
+    Usage:
+    ```py
+    >>> ids = IDAllocator(bot.mongo["tags"]["counters"])
+    >>> await ids.allocate(guild_id, tags)
+    42
+    ```
+    """
+
+    def __init__(self, counters: AsyncIOMotorCollection) -> None:
+        self.counters = counters
+
+    async def _next(self, guild_id: int, count: int) -> int | None:
+        counter = await self.counters.find_one_and_update(
+            {"_id": guild_id},
+            {"$inc": {"last": count}},
+            projection={"last": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        return None if counter is None else counter["last"] - count + 1
+
+    async def allocate(
+        self, guild_id: int, collection: AsyncIOMotorCollection, count: int = 1
+    ) -> int:
+        """Reserves `count` consecutive IDs and returns the first."""
+
+        tag_id = await self._next(guild_id, count)
+
+        if tag_id is not None:
+            return tag_id
+
+        # $max keeps seeding safe when two creations race to do it.
+        latest = await collection.find_one(
+            {"_id": {"$type": "number"}}, {"_id": 1}, sort=[("_id", -1)]
+        )
+        await self.counters.update_one(
+            {"_id": guild_id},
+            {"$max": {"last": latest["_id"] if latest else 0}},
+            upsert=True,
+        )
+
+        return await self._next(guild_id, count)
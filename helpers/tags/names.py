@@ -0,0 +1,243 @@
+import asyncio
+from collections import Counter, OrderedDict
+from typing import AsyncIterable, Callable
+
+Loader = Callable[[int], AsyncIterable[str]]
+
+
+def trigrams(name: str) -> set[str]:
+    # Padding makes the start and end of a name count for more.
+    padded = f"  {name} "
+    return {padded[index : index + 3] for index in range(len(padded) - 2)}
+
+
+class GuildNames:
+
+    """
+    One guild's tag names, by their case-folded form.
+
+    The trigram index used for suggestions is only built the first time
+    something is searched for, and kept current from then on.
+    """
+
+    __slots__ = ("names", "grams", "sizes")
+
+    def __init__(self, names: list[str]) -> None:
+        self.names: dict[str, list[str]] = {}
+        # trigram: names containing it, and name: how many trigrams it has.
+        self.grams: dict[str, set[str]] | None = None
+        self.sizes: dict[str, int] = {}
+
+        for name in names:
+            self.add(name)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name.casefold() in self.names
+
+    def add(self, name: str) -> None:
+        folded = name.casefold()
+        originals = self.names.setdefault(folded, [])
+
+        if name not in originals:
+            originals.append(name)
+
+        if self.grams is not None:
+            self._index(folded)
+
+    def _index(self, folded: str) -> None:
+        grams = trigrams(folded)
+        self.sizes[folded] = len(grams)
+
+        for gram in grams:
+            self.grams.setdefault(gram, set()).add(folded)
+
+    def remove(self, name: str) -> None:
+        folded = name.casefold()
+        originals = self.names.get(folded)
+
+        if originals is None or name not in originals:
+            return
+
+        originals.remove(name)
+
+        # Another tag still folds to the same name.
+        if originals:
+            return
+
+        del self.names[folded]
+
+        if self.grams is not None:
+            del self.sizes[folded]
+
+            for gram in trigrams(folded):
+                postings = self.grams.get(gram)
+
+                if postings is not None:
+                    postings.discard(folded)
+
+                    if not postings:
+                        del self.grams[gram]
+
+    def suggest(self, query: str, limit: int = 3, threshold: float = 0.3) -> list[str]:
+        """Names most like `query` by trigram similarity, best first."""
+
+        if self.grams is None:
+            self.grams = {}
+
+            for folded in self.names:
+                self._index(folded)
+
+        query_grams = trigrams(query.casefold())
+        shared = Counter()
+
+        for gram in query_grams:
+            shared.update(self.grams.get(gram, ()))
+
+        scored = []
+        sizes = self.sizes
+        size = len(query_grams)
+
+        for folded, count in shared.items():
+            # Jaccard similarity of the two trigram sets.
+            score = count / (size + sizes[folded] - count)
+
+            if score >= threshold:
+                scored.append((score, folded))
+
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [self.names[folded][0] for _, folded in scored[:limit]]
+
+
+class TagNames:
+
+    """
+    The tag names of every guild that asks for them.
+
+    Lets a message be ruled out as a tag without a query, and finds close
+    names for tags that don't exist. A guild's names are loaded through
+    `loader` the first time they are needed and then kept current by the
+    caller. Once more than `max_names` names are held in total, the least
+    recently used guilds are dropped and loaded again on their next use.
+
+    Usage:
+    ```py
+    >>> names = TagNames(load_names)
+    >>> await names.contains(guild_id, "Hello")
+    True
+    >>> await names.suggest(guild_id, "helo")
+    ['hello']
+    ```
+    """
+
+    def __init__(self, loader: Loader, *, max_names: int = 200_000) -> None:
+        self.loader = loader
+        self.max_names = max_names
+
+        self._guilds: OrderedDict[int, GuildNames] = OrderedDict()
+        self._loading: dict[int, asyncio.Task] = {}
+        # Changes made while a guild is loading, applied once it has loaded.
+        self._added: dict[int, list[str]] = {}
+        self._stale: set[int] = set()
+        self.names: int = 0
+
+        self.loads: int = 0
+        self.evictions: int = 0
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "guilds": len(self._guilds),
+            "names": self.names,
+            "max_names": self.max_names,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+    async def _load(self, guild_id: int) -> GuildNames:
+        try:
+            names = GuildNames([name async for name in self.loader(guild_id)])
+        finally:
+            self._loading.pop(guild_id, None)
+            added = self._added.pop(guild_id, [])
+            stale = guild_id in self._stale
+            self._stale.discard(guild_id)
+
+        for name in added:
+            names.add(name)
+
+        # Deleted from while loading, so the names may already be out of date.
+        if stale:
+            return names
+
+        self._guilds[guild_id] = names
+        self.names += len(names)
+        self.loads += 1
+        self._evict()
+
+        return names
+
+    async def get(self, guild_id: int) -> GuildNames:
+        names = self._guilds.get(guild_id)
+
+        if names is not None:
+            self._guilds.move_to_end(guild_id)
+            return names
+
+        # Concurrent callers share a single load.
+        task = self._loading.get(guild_id)
+        if task is None:
+            task = self._loading[guild_id] = asyncio.create_task(self._load(guild_id))
+
+        return await asyncio.shield(task)
+
+    def peek(self, guild_id: int) -> GuildNames | None:
+        """A guild's names if they are held, without loading them or marking them as used."""
+        return self._guilds.get(guild_id)
+
+    async def contains(self, guild_id: int, name: str) -> bool:
+        return name in await self.get(guild_id)
+
+    async def suggest(self, guild_id: int, name: str, limit: int = 3) -> list[str]:
+        return (await self.get(guild_id)).suggest(name, limit)
+
+    def add(self, guild_id: int, name: str) -> None:
+        names = self._guilds.get(guild_id)
+
+        if names is None:
+            if guild_id in self._loading:
+                self._added.setdefault(guild_id, []).append(name)
+            return
+
+        self.names -= len(names)
+        names.add(name)
+        self.names += len(names)
+
+    def remove(self, guild_id: int, name: str) -> None:
+        names = self._guilds.get(guild_id)
+
+        if names is None:
+            if guild_id in self._loading:
+                self._stale.add(guild_id)
+            return
+
+        self.names -= len(names)
+        names.remove(name)
+        self.names += len(names)
+
+    def invalidate(self, guild_id: int) -> None:
+        names = self._guilds.pop(guild_id, None)
+
+        if names is not None:
+            self.names -= len(names)
+
+        if guild_id in self._loading:
+            self._stale.add(guild_id)
+
+    def _evict(self) -> None:
+        while self.names > self.max_names and len(self._guilds) > 1:
+            _, names = self._guilds.popitem(last=False)
+            self.names -= len(names)
+            self.evictions += 1
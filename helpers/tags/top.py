@@ -0,0 +1,86 @@
+from collections import OrderedDict
+
+
+class TopTags:
+
+    """
+    The most used tags of each guild that has asked for them.
+
+    A guild is seeded once with its most used tags from the database and
+    then kept current as tags are used, so listing them never sorts the
+    collection. Twice the requested size is held, and a used tag that isn't
+    held replaces the least used one once its count passes it. That count is
+    the tag document's plus the uses that haven't been written to it yet.
+
+    Usage:
+    ```py
+    >>> top = TopTags(size=10)
+    >>> top.load(guild_id, tags)
+    >>> top.record(guild_id, tag, unwritten=3)
+    >>> top.top(guild_id)
+    [('hello', 120), ('rules', 87)]
+    ```
+    """
+
+    def __init__(self, *, size: int = 10, max_guilds: int = 1000) -> None:
+        self.size = size
+        self.capacity = size * 2
+        self.max_guilds = max_guilds
+
+        # guild ID: {tag ID: [uses, name]}
+        self._guilds: OrderedDict[int, dict[int, list]] = OrderedDict()
+
+    def loaded(self, guild_id: int) -> bool:
+        return guild_id in self._guilds
+
+    def load(self, guild_id: int, tags: list[dict]) -> None:
+        self._guilds[guild_id] = {
+            tag["_id"]: [tag.get("uses", 0), tag["name"]] for tag in tags[: self.capacity]
+        }
+
+        while len(self._guilds) > self.max_guilds:
+            self._guilds.popitem(last=False)
+
+    def record(self, guild_id: int, tag: dict, uses: int = 1, *, unwritten: int = 0) -> None:
+        """Counts `uses` of a tag, which had `unwritten` uses missing from its document."""
+
+        entries = self._guilds.get(guild_id)
+
+        if entries is None:
+            return
+
+        entry = entries.get(tag["_id"])
+
+        if entry is not None:
+            entry[0] += uses
+            return
+
+        count = tag.get("uses", 0) + unwritten + uses
+
+        if len(entries) < self.capacity:
+            entries[tag["_id"]] = [count, tag["name"]]
+            return
+
+        least = min(entries, key=lambda tag_id: entries[tag_id][0])
+
+        if count > entries[least][0]:
+            del entries[least]
+            entries[tag["_id"]] = [count, tag["name"]]
+
+    def remove(self, guild_id: int, tag_id: int) -> None:
+        entries = self._guilds.get(guild_id)
+
+        if entries is not None:
+            entries.pop(tag_id, None)
+
+    def top(self, guild_id: int, amount: int | None = None) -> list[tuple[str, int]]:
+        """(name, uses) of the most used tags, most used first."""
+
+        entries = self._guilds.get(guild_id)
+
+        if entries is None:
+            return []
+
+        self._guilds.move_to_end(guild_id)
+        ranked = sorted(entries.values(), key=lambda entry: -entry[0])
+        return [(name, uses) for uses, name in ranked[: amount or self.size]]
@@ -0,0 +1,229 @@
+import csv
+import json
+import tempfile
+import time
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable
+
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorCursor
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from helpers.indexes import NAME_COLLATION
+from helpers.tags.names import TagNames
+
+# What is kept of a tag when it leaves a server, its ID is given out again.
+FIELDS = ("name", "content", "owner", "created", "uses")
+POLICIES = ("skip", "overwrite", "rename")
+
+MAX_NAME = 100
+MAX_CONTENT = 2000
+# The longest CSV record a valid tag can take, with every quote in it doubled
+# and room for the other fields.
+MAX_RECORD = 2 * (MAX_NAME + MAX_CONTENT) + 256
+
+
+async def export_tags(
+    cursor: AsyncIOMotorCursor, *, batch_size: int = 500, max_size: int = 1024 * 1024
+) -> tempfile.SpooledTemporaryFile:
+
+    """
+    Streams a tag cursor into a JSONL file, one tag per line.
+
+    Like the level export, the file stays in memory until it grows past
+    `max_size` bytes and is returned rewound; the caller closes it.
+    """
+
+    file = tempfile.SpooledTemporaryFile(max_size=max_size)
+
+    async for tag in cursor.batch_size(batch_size):
+        row = {field: tag[field] for field in FIELDS if field in tag}
+        file.write((json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    file.seek(0)
+    return file
+
+
+async def read_rows(lines: AsyncIterable[bytes], format: str) -> AsyncIterator[dict]:
+
+    """
+    Parses uploaded tags line by line, as JSONL or as CSV with a header.
+
+    A CSV record whose quoted content spans several lines is put back
+    together before being parsed, up to `MAX_RECORD` characters. Rows that
+    can't be parsed, like a record left open by a stray quote, are yielded
+    as None so they can be counted.
+    """
+
+    header = None
+    record = ""
+    quotes = 0
+
+    async for line in lines:
+        text = line.decode("utf-8-sig", errors="replace")
+
+        if format == "jsonl":
+            if not text.strip():
+                continue
+
+            try:
+                row = json.loads(text)
+            except ValueError:
+                row = None
+
+            yield row if isinstance(row, dict) else None
+            continue
+
+        # An odd number of quotes means a quoted field continues on the next line.
+        record += text
+        quotes += text.count('"')
+
+        if quotes % 2:
+            # Too long for any valid tag, most likely an unmatched quote.
+            if len(record) > MAX_RECORD:
+                record, quotes = "", 0
+                yield None
+
+            continue
+
+        values = next(csv.reader([record]), [])
+        record, quotes = "", 0
+
+        if not values:
+            continue
+
+        if header is None:
+            header = [value.strip().lower() for value in values]
+            continue
+
+        yield dict(zip(header, values))
+
+    # Still waiting for a closing quote at the end of the file.
+    if record:
+        yield None
+
+
+def _clean(row: dict | None, owner: int) -> dict | None:
+    if row is None:
+        return None
+
+    name = str(row.get("name") or "").strip()
+    content = str(row.get("content") or "")
+
+    if not name or len(name) > MAX_NAME or not content or len(content) > MAX_CONTENT:
+        return None
+
+    try:
+        tag = {
+            "owner": int(row.get("owner") or owner),
+            "name": name,
+            "content": content,
+            "created": int(row.get("created") or time.time()),
+        }
+
+        if row.get("uses"):
+            tag["uses"] = int(row["uses"])
+    except (TypeError, ValueError):
+        return None
+
+    return tag
+
+
+async def import_tags(
+    rows: AsyncIterable[dict | None],
+    collection: AsyncIOMotorCollection,
+    guild_id: int,
+    *,
+    names: TagNames,
+    allocate: Callable[[int], Awaitable[int]],
+    owner: int,
+    policy: str = "skip",
+    batch_size: int = 500,
+) -> dict[str, int]:
+
+    """
+    Writes parsed tags into a guild in ordered bulk writes of `batch_size`.
+
+    A name that is already taken, by an existing tag or an earlier row, is
+    skipped, overwritten or renamed to the first free `name-2`, `name-3`...
+    depending on `policy`. Rows without an owner are given `owner`. New
+    tags get their IDs from `allocate`, a block per batch. Returns how many
+    tags ended up in each outcome.
+    """
+
+    result = dict.fromkeys(("created", "overwritten", "renamed", "skipped", "invalid", "failed"), 0)
+    batch = []
+
+    async def write() -> None:
+        inserts = [tag for action, tag in batch if action != "overwritten"]
+        first = await allocate(len(inserts)) if inserts else 0
+
+        for offset, tag in enumerate(inserts):
+            tag["_id"] = first + offset
+
+        requests = [
+            InsertOne(tag)
+            if action != "overwritten"
+            else UpdateOne(
+                {"name": tag["name"]},
+                {"$set": {"content": tag["content"], "owner": tag["owner"]}},
+                collation=NAME_COLLATION,
+            )
+            for action, tag in batch
+        ]
+
+        try:
+            await collection.bulk_write(requests, ordered=True)
+            done = len(batch)
+        except BulkWriteError as err:
+            # Ordered, so everything before the first error was written.
+            done = err.details["writeErrors"][0]["index"]
+            result["failed"] += len(batch) - done
+            # Names were claimed for rows that didn't make it.
+            names.invalidate(guild_id)
+
+        for action, _ in batch[:done]:
+            result[action] += 1
+
+        batch.clear()
+
+    taken = await names.get(guild_id)
+
+    async for row in rows:
+        tag = _clean(row, owner)
+
+        if tag is None:
+            result["invalid"] += 1
+            continue
+
+        action = "created"
+
+        if tag["name"] in taken:
+            if policy == "skip":
+                result["skipped"] += 1
+                continue
+
+            if policy == "overwrite":
+                action = "overwritten"
+            else:
+                base, number = tag["name"][: MAX_NAME - 4], 2
+
+                while f"{base}-{number}" in taken:
+                    number += 1
+
+                tag["name"] = f"{base}-{number}"
+                action = "renamed"
+
+        if action != "overwritten":
+            names.add(guild_id, tag["name"])
+            # The guild may have been evicted from `names` while importing.
+            taken.add(tag["name"])
+
+        batch.append((action, tag))
+
+        if len(batch) >= batch_size:
+            await write()
+
+    if batch:
+        await write()
+
+    return result
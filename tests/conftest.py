@@ -0,0 +1,224 @@
+import contextlib
+import re
+from types import SimpleNamespace
+
+import discord
+import pytest
+from mongomock_motor import AsyncCursor, AsyncMongoMockClient, AsyncMongoMockCollection
+
+from helpers.budgets import QueryBudget
+from helpers.indexes import IndexManager
+from helpers.storage import Storage
+
+# A server sends this many documents with a find before the client asks for more.
+FIRST_BATCH = 101
+
+# Collection methods that are one command each, and whether their reply holds a document.
+COMMANDS = {
+    "count_documents": True,
+    "create_indexes": False,
+    "delete_many": False,
+    "delete_one": False,
+    "find_one": True,
+    "find_one_and_update": True,
+    "insert_many": False,
+    "insert_one": False,
+    "replace_one": False,
+    "update_many": False,
+    "update_one": False,
+}
+
+
+def _collate(query: dict) -> dict:
+    # mongomock ignores collations, so match names in any case the way the
+    # name collation does.
+    collated = {}
+
+    for key, value in query.items():
+        if key in ("$or", "$and"):
+            value = [_collate(clause) for clause in value]
+        elif key == "name" and isinstance(value, str):
+            value = re.compile(f"^{re.escape(value)}$", re.IGNORECASE)
+
+        collated[key] = value
+
+    return collated
+
+
+def _commands(requests: list) -> int:
+    # A bulk write sends one command per run of requests of the same kind.
+    kinds = [type(request) for request in requests]
+    return sum(1 for index, kind in enumerate(kinds) if index == 0 or kinds[index - 1] is not kind)
+
+
+@pytest.fixture
+def budgets(monkeypatch: pytest.MonkeyPatch) -> QueryBudget:
+
+    """
+    A strict `QueryBudget` fed by mongomock-motor.
+
+    mongomock doesn't talk to a server, so there are no command events for
+    the listener. The stand-in's collection and cursor methods are wrapped
+    to report the commands and returned documents a server would.
+    """
+
+    budgets = QueryBudget(strict=True)
+
+    def command(documents: int = 0) -> None:
+        budgets.started(None)
+        budgets.succeeded(SimpleNamespace(reply={"cursor": {"firstBatch": [None] * documents}}))
+
+    for name, returns_document in COMMANDS.items():
+        method = getattr(AsyncMongoMockCollection, name)
+
+        def wrapper(method=method, returns_document=returns_document):
+            async def call(self, query=None, *args, **kwargs):
+                if kwargs.pop("collation", None) is not None:
+                    query = _collate(query)
+
+                result = await method(self, query, *args, **kwargs)
+                command(int(returns_document and result is not None))
+                return result
+
+            return call
+
+        monkeypatch.setattr(AsyncMongoMockCollection, name, wrapper())
+
+    find = AsyncMongoMockCollection.find
+
+    def collated_find(self, query=None, *args, **kwargs):
+        if kwargs.pop("collation", None) is not None:
+            query = _collate(query)
+
+        return find(self, query, *args, **kwargs)
+
+    monkeypatch.setattr(AsyncMongoMockCollection, "find", collated_find)
+
+    bulk_write = AsyncMongoMockCollection.bulk_write
+
+    async def bulk(self, requests, *args, **kwargs):
+        result = await bulk_write(self, requests, *args, **kwargs)
+
+        for _ in range(_commands(requests)):
+            command()
+
+        return result
+
+    monkeypatch.setattr(AsyncMongoMockCollection, "bulk_write", bulk)
+
+    batch_size = AsyncCursor.batch_size
+
+    def batch(self, size):
+        self._batch = size
+        return batch_size(self, size)
+
+    next_document = AsyncCursor.next
+
+    async def next(self):
+        # A find for the first batch, then a getMore for each batch after it,
+        # unless the limit was already reached.
+        fetched = self.__dict__.get("_fetched", 0)
+        size = self.__dict__.get("_batch")
+        limit = self._limit
+
+        first = size or FIRST_BATCH
+        more = fetched >= first and not (limit and fetched >= limit)
+
+        # Without a batch size, everything after the first batch comes at once.
+        if fetched == 0 or more and (fetched - first) % (size or first + fetched) == 0:
+            budgets.started(None)
+
+        try:
+            document = await next_document(self)
+        except StopAsyncIteration:
+            budgets.succeeded(SimpleNamespace(reply={}))
+            raise
+
+        self._fetched = fetched + 1
+        budgets.succeeded(SimpleNamespace(reply={"cursor": {"nextBatch": [document]}}))
+        return document
+
+    async def to_list(self, length=None):
+        documents = []
+
+        async for document in self:
+            documents.append(document)
+
+            if length is not None and len(documents) >= length:
+                break
+
+        return documents
+
+    monkeypatch.setattr(AsyncCursor, "batch_size", batch)
+    monkeypatch.setattr(AsyncCursor, "next", next)
+    monkeypatch.setattr(AsyncCursor, "__anext__", next)
+    monkeypatch.setattr(AsyncCursor, "to_list", to_list)
+
+    return budgets
+
+
+class FakeBot:
+
+    """The parts of `Bonbons` the level and tag cogs use, over a mongomock-motor client."""
+
+    def __init__(self, budgets: QueryBudget, *, mode: str = "shared") -> None:
+        self.mongo = AsyncMongoMockClient()
+        self.budgets = budgets
+        # mongomock can't build collated indexes, and they change no query counts.
+        self.indexes = IndexManager({})
+        self.storage = Storage(self.mongo, self.indexes, mode=mode)
+        self.commands: set[str] = {"tag", "rank", "leaderboard"}
+        self.processed: list[str] = []
+
+    def get_user(self, user_id: int) -> None:
+        return None
+
+    async def fetch_user(self, user_id: int) -> None:
+        return None
+
+    async def get_context(self, message) -> SimpleNamespace:
+        prefix = "b!" if message.content.startswith("b!") else None
+        invoked_with = message.content[2:].split(" ")[0] if prefix else None
+        return SimpleNamespace(
+            prefix=prefix, invoked_with=invoked_with, command=None, guild=message.guild
+        )
+
+    async def process_commands(self, message) -> None:
+        self.processed.append(message.content)
+
+    async def invoke(self, command, cog, ctx, *args, **kwargs) -> None:
+        """Runs a command's callback under its budget, like `Bonbons`' invoke hooks."""
+
+        usage = self.budgets.open(command.qualified_name)
+
+        try:
+            await command.callback(cog, ctx, *args, **kwargs)
+        finally:
+            self.budgets.close(usage)
+
+
+class FakeContext:
+    def __init__(self, guild_id: int, author_id: int) -> None:
+        self.guild = SimpleNamespace(id=guild_id, name="Test server")
+        self.author = SimpleNamespace(id=author_id, bot=False)
+        self.clean_prefix = "b!"
+        self.message = SimpleNamespace(reference=None, attachments=[])
+        self.sent: list = []
+
+    async def send(self, content=None, **kwargs) -> None:
+        self.sent.append(content if content is not None else kwargs)
+
+    reply = send
+
+    def typing(self) -> contextlib.nullcontext:
+        return contextlib.nullcontext()
+
+
+def message(guild_id: int, author_id: int, content: str = "hello") -> SimpleNamespace:
+    # handle_message only counts messages from text channels.
+    return SimpleNamespace(
+        guild=SimpleNamespace(id=guild_id),
+        author=SimpleNamespace(id=author_id, bot=False),
+        channel=discord.TextChannel.__new__(discord.TextChannel),
+        content=content,
+    )
@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from helpers.accumulator import Accumulator
+
+GUILD = 1
+
+
+def test_partial_failure_requeues_failed_keys() -> None:
+    written = []
+
+    async def writer(guild_id: int, pending: dict[int, int]) -> None:
+        written.append(dict(pending))
+
+        if len(written) == 1:
+            # The second of three operations failed.
+            raise BulkWriteError({"writeErrors": [{"index": 1}]})
+
+    async def main() -> Accumulator:
+        accumulator = Accumulator(writer, name="uses")
+
+        for key, amount in ((10, 1), (20, 2), (30, 3)):
+            accumulator.add(GUILD, key, amount)
+
+        with pytest.raises(BulkWriteError):
+            await accumulator.flush(GUILD)
+
+        assert accumulator.get(GUILD, 10) == 0
+        assert accumulator.get(GUILD, 20) == 2
+
+        await accumulator.flush(GUILD)
+        return accumulator
+
+    accumulator = asyncio.run(main())
+
+    assert written[1] == {20: 2}
+    assert accumulator.stats["failures"] == 1
+    assert accumulator.pending == 0
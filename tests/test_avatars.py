@@ -0,0 +1,59 @@
+import asyncio
+import io
+from types import SimpleNamespace
+
+from PIL import Image
+
+from helpers.levels.avatars import AvatarCache
+
+
+class FakeAsset:
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.reads = 0
+
+    def replace(self, **kwargs) -> "FakeAsset":
+        return self
+
+    async def read(self) -> bytes:
+        self.reads += 1
+
+        with io.BytesIO() as buffer:
+            Image.new("RGBA", (64, 64), "#5865F2").save(buffer, "PNG")
+            return buffer.getvalue()
+
+
+def test_member_and_user_avatars_dont_evict_each_other(tmp_path) -> None:
+    guild_avatar, global_avatar = FakeAsset("a_guild"), FakeAsset("a_global")
+    # The same person, as a member with a guild avatar and as a user.
+    member = SimpleNamespace(id=1, display_avatar=guild_avatar)
+    user = SimpleNamespace(id=1, display_avatar=global_avatar)
+
+    async def main() -> AvatarCache:
+        avatars = AvatarCache(str(tmp_path))
+
+        for _ in range(3):
+            await avatars.get(member, 150)
+            await avatars.get(user, 128)
+
+        return avatars
+
+    avatars = asyncio.run(main())
+
+    assert (guild_avatar.reads, global_avatar.reads) == (1, 1)
+    assert avatars.stats["files"] == 2
+
+
+def test_invalidate_drops_files(tmp_path) -> None:
+    asset = FakeAsset("a_old")
+
+    async def main() -> AvatarCache:
+        avatars = AvatarCache(str(tmp_path))
+        await avatars.get(SimpleNamespace(id=1, display_avatar=asset), 150)
+        await avatars.invalidate("a_old")
+        return avatars
+
+    avatars = asyncio.run(main())
+
+    assert avatars.stats["files"] == 0
+    assert not list(tmp_path.iterdir())
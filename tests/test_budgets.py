@@ -0,0 +1,285 @@
+import asyncio
+import contextlib
+from types import SimpleNamespace
+
+import discord
+import pytest
+from discord.ext import commands
+from discord.ext.commands.view import StringView
+from mongomock_motor import AsyncMongoMockClient
+from pymongo import IndexModel
+
+from cogs.levels import Levels
+from cogs.tags import Tags
+from conftest import FakeBot, FakeContext, message
+from helpers.bot import Bonbons
+from helpers.budgets import BUDGETS, Budget, BudgetExceeded, QueryBudget
+from helpers.indexes import IndexManager
+from helpers.levels.avatars import AvatarCache
+from helpers.storage import Storage
+from helpers.tags.cache import TagCache
+
+GUILD = 1
+OWNER = 10
+
+
+@pytest.fixture(params=("shared", "guild"))
+def bot(request: pytest.FixtureRequest, budgets: QueryBudget) -> FakeBot:
+    return FakeBot(budgets, mode=request.param)
+
+
+@pytest.fixture(autouse=True)
+def cache_directory(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    # The avatar cache writes under the working directory, which the render
+    # workers need to stay the repository's.
+    monkeypatch.setattr(
+        "cogs.levels.AvatarCache", lambda _, **kwargs: AvatarCache(str(tmp_path), **kwargs)
+    )
+
+
+@contextlib.asynccontextmanager
+async def loaded(cog: discord.ext.commands.Cog):
+    await discord.utils.maybe_coroutine(cog.cog_load)
+
+    try:
+        yield cog
+    finally:
+        await cog.cog_unload()
+
+
+def test_handle_message_stays_in_memory(bot: FakeBot, budgets: QueryBudget) -> None:
+    async def main() -> None:
+        async with loaded(Levels(bot)) as levels:
+            for author in range(50):
+                await levels.handle_message(message(GUILD, author))
+
+            # On cooldown, so not counted at all.
+            await levels.handle_message(message(GUILD, 0))
+
+            assert levels.accumulator.pending == 50
+
+    asyncio.run(main())
+    assert budgets.stats["Levels.handle_message"]["max_round_trips"] == 0
+
+
+def test_leaderboard_flushes_in_one_write(bot: FakeBot, budgets: QueryBudget) -> None:
+    async def main() -> FakeContext:
+        async with loaded(Levels(bot)) as levels:
+            for author in range(20):
+                await levels.handle_message(message(GUILD, author))
+
+            ctx = FakeContext(GUILD, OWNER)
+            await bot.invoke(levels.leaderboard, levels, ctx)
+            return ctx
+
+    ctx = asyncio.run(main())
+
+    assert ctx.sent
+    assert budgets.stats["leaderboard"]["max_round_trips"] == 1
+    # Loading the rank index is charged to its own path.
+    assert budgets.stats["Levels.load_ranks"]["calls"] == 1
+
+
+def test_tag_create_fits_its_budget_for_a_new_guild(bot: FakeBot, budgets: QueryBudget) -> None:
+    async def main() -> None:
+        async with loaded(Tags(bot)) as tags:
+            ctx = FakeContext(GUILD, OWNER)
+            await bot.invoke(tags.create, tags, ctx, "hello", content="Hello there!")
+            first = budgets.stats["tag create"]["round_trips"]
+
+            await bot.invoke(tags.create, tags, ctx, "rules", content="Be nice.")
+            assert budgets.stats["tag create"]["round_trips"] - first == 2
+
+            # The name set can't rule this one out, so it costs a lookup.
+            await bot.invoke(tags.create, tags, ctx, "HELLO", content="Again")
+            assert ctx.sent[-1] == "A tag with this name already exists."
+
+    asyncio.run(main())
+    # Seeding the ID counter, then the insert.
+    assert budgets.stats["tag create"]["max_round_trips"] == 5
+
+
+def test_index_builds_arent_charged_to_commands(budgets: QueryBudget) -> None:
+    bot = FakeBot(budgets, mode="guild")
+    bot.indexes = IndexManager({"tags": [IndexModel([("owner", 1)])]})
+    bot.storage.indexes = bot.indexes
+
+    async def main() -> None:
+        async with loaded(Tags(bot)) as tags:
+            ctx = FakeContext(GUILD, OWNER)
+            await bot.invoke(tags.create, tags, ctx, "hello", content="Hi")
+            await asyncio.gather(*bot.indexes._tasks.values())
+
+    asyncio.run(main())
+    assert budgets.stats["tag create"]["max_round_trips"] == 5
+
+
+def test_tag_lookups(bot: FakeBot, budgets: QueryBudget) -> None:
+    async def main() -> FakeContext:
+        async with loaded(Tags(bot)) as tags:
+            ctx = FakeContext(GUILD, OWNER)
+            await bot.invoke(tags.create, tags, ctx, "hello", content="Hello there!")
+
+            # Cached by create.
+            await bot.invoke(tags.tag, tags, ctx, "hello")
+
+            tags.cache = TagCache()
+            await bot.invoke(tags.tag, tags, ctx, "Hello")
+            await bot.invoke(tags.tag, tags, ctx, "1")
+            await bot.invoke(tags.tag, tags, ctx, "nothing")
+            return ctx
+
+    ctx = asyncio.run(main())
+
+    assert ctx.sent[1:4] == ["Hello there!"] * 3
+    assert ctx.sent[4].startswith("A tag with the name `nothing` does not exist.")
+    assert budgets.stats["tag"]["max_round_trips"] == 1
+
+
+def test_exact_case_wins_over_a_cached_tag(bot: FakeBot) -> None:
+    async def main() -> FakeContext:
+        async with loaded(Tags(bot)) as tags:
+            ctx = FakeContext(GUILD, OWNER)
+            await bot.invoke(tags.create, tags, ctx, "hello", content="lower")
+            # Names that only differ in case can come from older data.
+            await tags.collection(GUILD).insert_one(
+                {"_id": 100, "name": "Hello", "content": "title", "owner": OWNER}
+            )
+
+            await bot.invoke(tags.tag, tags, ctx, "hello")
+            await bot.invoke(tags.tag, tags, ctx, "Hello")
+            await bot.invoke(tags.tag, tags, ctx, "hello")
+            return ctx
+
+    ctx = asyncio.run(main())
+    assert ctx.sent[1:] == ["lower", "title", "lower"]
+
+
+def test_cached_id_doesnt_hide_a_numeric_name(bot: FakeBot) -> None:
+    async def main() -> FakeContext:
+        async with loaded(Tags(bot)) as tags:
+            ctx = FakeContext(GUILD, OWNER)
+            await bot.invoke(tags.create, tags, ctx, "hello", content="by ID")
+            hello = await tags.get_tag(GUILD, "hello")
+            # A tag named after that ID, which isn't cached.
+            await tags.collection(GUILD).insert_one(
+                {"_id": 100, "name": str(hello["_id"]), "content": "by name", "owner": OWNER}
+            )
+            tags.names.add(GUILD, str(hello["_id"]))
+
+            await bot.invoke(tags.tag, tags, ctx, str(hello["_id"]))
+            return ctx
+
+    ctx = asyncio.run(main())
+    assert ctx.sent[-1] == "by name"
+
+
+def test_flushed_uses_reach_cached_tags(bot: FakeBot) -> None:
+    async def main() -> tuple[dict, dict]:
+        async with loaded(Tags(bot)) as tags:
+            ctx = FakeContext(GUILD, OWNER)
+            await bot.invoke(tags.create, tags, ctx, "hello", content="Hi")
+
+            for _ in range(3):
+                await bot.invoke(tags.tag, tags, ctx, "hello")
+
+            await tags.uses.flush(GUILD)
+            cached = await tags.get_tag(GUILD, "hello")
+            stored = await tags.collection(GUILD).find_one({"name": "hello"})
+            return cached, stored
+
+    cached, stored = asyncio.run(main())
+    assert cached["uses"] == stored["uses"] == 3
+
+
+def test_send_tag_rules_out_other_messages(bot: FakeBot, budgets: QueryBudget) -> None:
+    async def main() -> None:
+        async with loaded(Tags(bot)) as tags:
+            await bot.invoke(tags.create, tags, FakeContext(GUILD, OWNER), "hello", content="Hi")
+            tags.cache = TagCache()
+
+            await tags.send_tag(message(GUILD, OWNER, "b!unknown"))
+            assert budgets.stats["Tags.send_tag"]["max_round_trips"] == 0
+
+            await tags.send_tag(message(GUILD, OWNER, "b!hello"))
+            assert budgets.stats["Tags.send_tag"]["max_round_trips"] == 1
+
+    asyncio.run(main())
+    assert bot.processed == ["b!unknown", "b!tag hello"]
+
+
+class DispatchedContext(commands.Context):
+    clean_prefix = "b!"
+
+    async def send(self, content=None, **kwargs) -> None:
+        self.sent.append(content if content is not None else kwargs)
+
+    reply = send
+
+
+async def dispatch(bot: Bonbons, content: str) -> DispatchedContext:
+    # What `get_context` does for a message, without a gateway connection.
+    message = SimpleNamespace(
+        guild=SimpleNamespace(id=GUILD, name="Test server"),
+        author=SimpleNamespace(id=OWNER, bot=False),
+        content=content,
+        reference=None,
+        attachments=[],
+        _state=bot._connection,
+    )
+    view = StringView(content)
+    view.skip_string("b!")
+    invoked_with = view.get_word()
+
+    ctx = DispatchedContext(
+        message=message,
+        bot=bot,
+        view=view,
+        prefix="b!",
+        invoked_with=invoked_with,
+        command=bot.all_commands.get(invoked_with),
+    )
+    ctx.sent = []
+    await bot.invoke(ctx)
+    return ctx
+
+
+def test_subcommands_are_charged_to_their_own_budget(budgets: QueryBudget) -> None:
+    bot = Bonbons()
+    bot.budgets = budgets
+    bot.mongo = AsyncMongoMockClient()
+    bot.indexes = IndexManager({})
+    bot.storage = Storage(bot.mongo, bot.indexes, mode="shared")
+
+    async def main() -> list:
+        await bot.add_cog(Tags(bot))
+
+        try:
+            created = await dispatch(bot, "b!tag create hello Hello there!")
+            found = await dispatch(bot, "b!tag hello")
+            return created.sent + found.sent
+        finally:
+            await bot.remove_cog("Tags")
+
+    sent = asyncio.run(main())
+
+    assert sent[-1] == "Hello there!"
+    # Found under the `tag` group, but charged to the subcommand.
+    assert budgets.stats["tag create"]["calls"] == 1
+    assert budgets.stats["tag"]["calls"] == 1
+
+
+def test_going_over_a_budget_fails(
+    bot: FakeBot, budgets: QueryBudget, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setitem(BUDGETS, "tag", Budget(0, 0))
+
+    async def main() -> None:
+        async with loaded(Tags(bot)) as tags:
+            await bot.invoke(tags.create, tags, FakeContext(GUILD, OWNER), "hello", content="Hi")
+            tags.cache = TagCache()
+
+            with pytest.raises(BudgetExceeded):
+                await bot.invoke(tags.tag, tags, FakeContext(GUILD, OWNER), "hello")
+
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+from easy_pil import Canvas, Editor
+from PIL import Image
+
+from helpers.levels.render import RenderPool, _font, _text, pack, render_rank_card
+
+
+@pytest.mark.parametrize(
+    ("text", "size", "color", "align"),
+    [
+        ("Bonbons#0001", 40, "white", "left"),
+        ("of 1,024", 30, "#b9bbbe", "right"),
+        ("Ágŷ • Level 12", 50, "white", "left"),
+    ],
+)
+def test_cached_text_draws_like_editor(text: str, size: int, color: str, align: str) -> None:
+    expected = Editor(Canvas((800, 280), color="#23272A"))
+    expected.text((400, 40), text, font=_font(size), color=color, align=align)
+
+    # Twice, the second time from the cache.
+    for _ in range(2):
+        drawn = Editor(Canvas((800, 280), color="#23272A"))
+        _text(drawn, (400, 40), text, size, color, align=align)
+
+        assert drawn.image.tobytes() == expected.image.tobytes()
+
+
+CARD = {
+    "name": "Bonbons#0001",
+    "xp": 1234,
+    "next_level_xp": 2500,
+    "level": 19,
+    "percentage": 49,
+    "rank": 3,
+    "members": 1024,
+    "avatar": pack(Image.new("RGBA", (150, 150), "#5865F2")),
+    "background": None,
+}
+
+
+def test_rank_card_is_a_png() -> None:
+    assert render_rank_card(CARD).startswith(b"\x89PNG")
+
+
+def test_pool_renders_in_a_worker() -> None:
+    async def main() -> tuple[bytes, str]:
+        pool = RenderPool(workers=1)
+
+        try:
+            image = await pool.render(render_rank_card, CARD)
+            return image, pool.executor._mp_context.get_start_method()
+        finally:
+            pool.close()
+
+    image, start_method = asyncio.run(main())
+
+    assert image == render_rank_card(CARD)
+    assert start_method != "fork"
@@ -0,0 +1,45 @@
+import asyncio
+import contextlib
+from types import SimpleNamespace
+
+from cogs.useful import RTFM_PAGES, Useful
+
+
+class FakeBot:
+
+    """Opens its session once ready, like `Bonbons.on_ready`."""
+
+    def __init__(self) -> None:
+        self.ready = asyncio.Event()
+
+    async def wait_until_ready(self) -> None:
+        await self.ready.wait()
+
+    def open(self) -> None:
+        @contextlib.asynccontextmanager
+        async def get(url, **kwargs):
+            yield SimpleNamespace(status=304, headers={})
+
+        self.session = SimpleNamespace(get=get)
+        self.ready.set()
+
+
+def test_builds_wait_for_the_session(tmp_path) -> None:
+    async def main() -> tuple[dict, Useful]:
+        bot = FakeBot()
+        cog = Useful(bot)
+        cog.inventories.path = str(tmp_path / "rtfm.pickle")
+        cog.inventories.set("python", RTFM_PAGES["python"], {"str.join": "..."}, etag='"1"')
+
+        # Started by the refresh loop or a command before on_ready.
+        build = asyncio.create_task(cog.build_rtfm_lookup_table({"python": RTFM_PAGES["python"]}))
+        await asyncio.sleep(0.01)
+        assert not build.done()
+        bot.open()
+
+        return await build, cog
+
+    failures, cog = asyncio.run(main())
+
+    assert failures == {}
+    assert cog.inventories.stats["not_modified"] == 1
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from cogs.tags import Tags
+from conftest import FakeBot
+from helpers.budgets import QueryBudget
+from helpers.storage import _projection
+
+
+@pytest.mark.parametrize(
+    ("projection", "expected"),
+    [
+        (None, {"_id": 0}),
+        (["name"], {"name": 1, "key": 1, "_id": 0}),
+        ({"name": 1}, {"name": 1, "key": 1, "_id": 0}),
+        # Leaving the key out, excluding it would mix in an exclusion.
+        ({"name": 1, "_id": 0}, {"name": 1, "_id": 0}),
+        ({"content": 0}, {"content": 0, "_id": 0}),
+        ({"content": 0, "_id": 0}, {"content": 0, "key": 0, "_id": 0}),
+    ],
+)
+def test_projection(projection, expected: dict) -> None:
+    assert _projection(projection) == expected
+
+
+@pytest.mark.parametrize("mode", ("shared", "guild"))
+def test_load_names(budgets: QueryBudget, mode: str) -> None:
+    bot = FakeBot(budgets, mode=mode)
+
+    async def main() -> list[str]:
+        tags = Tags(bot)
+
+        try:
+            for tag_id, (guild_id, name) in enumerate(((1, "hello"), (1, "rules"), (2, "other"))):
+                await tags.collection(guild_id).insert_one(
+                    {"_id": tag_id, "name": name, "content": "Hi", "owner": 10}
+                )
+
+            return [name async for name in tags.load_names(1)]
+        finally:
+            await tags.cog_unload()
+
+    assert sorted(asyncio.run(main())) == ["hello", "rules"]
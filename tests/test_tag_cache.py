@@ -0,0 +1,53 @@
+from helpers.tags.cache import TagCache
+
+GUILD = 1
+
+
+def tag(tag_id: int, name: str) -> dict:
+    return {"_id": tag_id, "name": name, "content": "Hi", "owner": 10}
+
+
+def test_numeric_name_counts_one_lookup() -> None:
+    cache = TagCache()
+
+    assert cache.get(GUILD, "7", tag_id=7) is None
+    assert (cache.hits, cache.misses) == (0, 1)
+
+
+def test_name_wins_over_id() -> None:
+    cache = TagCache()
+    cache.set(GUILD, tag(7, "rules"))
+    cache.set(GUILD, tag(3, "7"))
+
+    assert cache.get(GUILD, "7", tag_id=7)["_id"] == 3
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_renamed_tag_leaves_its_old_name() -> None:
+    cache = TagCache()
+    cache.set(GUILD, tag(1, "hello"))
+    cache.set(GUILD, tag(1, "goodbye"))
+
+    assert cache.get(GUILD, "hello") is None
+    assert cache.get(GUILD, "goodbye")["_id"] == 1
+
+
+def test_least_recently_used_goes_first() -> None:
+    cache = TagCache(max_entries=2)
+    cache.set(GUILD, tag(1, "one"))
+    cache.set(GUILD, tag(2, "two"))
+    cache.get_id(GUILD, 1)
+    cache.set(GUILD, tag(3, "three"))
+
+    assert cache.get_id(GUILD, 2) is None
+    assert cache.get_id(GUILD, 1) is not None
+    assert cache.evictions == 1
+
+
+def test_other_case_is_a_miss() -> None:
+    cache = TagCache()
+    cache.set(GUILD, tag(1, "hello"))
+
+    # Even with an ID to fall back on, a name in any case beats an ID.
+    assert cache.get(GUILD, "Hello", tag_id=1) is None
+    assert cache.get(GUILD, "hello")["_id"] == 1
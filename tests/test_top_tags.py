@@ -0,0 +1,21 @@
+from helpers.tags.top import TopTags
+
+GUILD = 1
+
+
+def test_unwritten_uses_count_towards_a_place() -> None:
+    top = TopTags(size=1)
+    top.load(GUILD, [{"_id": 1, "name": "rules", "uses": 12}, {"_id": 2, "name": "faq", "uses": 8}])
+
+    # Only 6 uses in its document, but 10 more haven't been written yet.
+    top.record(GUILD, {"_id": 3, "name": "hello", "uses": 6}, unwritten=10)
+
+    assert top.top(GUILD, 2) == [("hello", 17), ("rules", 12)]
+
+
+def test_stale_count_doesnt_take_a_place() -> None:
+    top = TopTags(size=1)
+    top.load(GUILD, [{"_id": 1, "name": "rules", "uses": 12}, {"_id": 2, "name": "faq", "uses": 8}])
+    top.record(GUILD, {"_id": 3, "name": "hello", "uses": 6})
+
+    assert top.top(GUILD, 2) == [("rules", 12), ("faq", 8)]
@@ -0,0 +1,33 @@
+import asyncio
+
+from helpers.tags.transfer import MAX_RECORD, read_rows
+
+
+def rows(*lines: str) -> list:
+    async def source():
+        for line in lines:
+            yield line.encode("utf-8")
+
+    async def main() -> list:
+        return [row async for row in read_rows(source(), "csv")]
+
+    return asyncio.run(main())
+
+
+def test_quoted_content_can_span_lines() -> None:
+    assert rows("name,content\n", 'hello,"Hi,\n', 'there"\n', "rules,Be nice.\n") == [
+        {"name": "hello", "content": "Hi,\nthere"},
+        {"name": "rules", "content": "Be nice."},
+    ]
+
+
+def test_record_left_open_is_invalid() -> None:
+    assert rows("name,content\n", 'a,He said "hi\n', "b,ok\n", "c,fine\n") == [None]
+
+
+def test_stray_quote_only_holds_back_so_much() -> None:
+    filler = [f"tag{index},{'x' * 100}\n" for index in range(MAX_RECORD // 100)]
+    parsed = rows("name,content\n", 'a,He said "hi\n', *filler, "after,kept\n")
+
+    assert parsed[0] is None
+    assert parsed[-1] == {"name": "after", "content": "kept"}